@@ -4,34 +4,142 @@ Implements a doubly-linked list with deletion, insertion, pushing, and multiplic
 @author: Elias Gabriel
 @revision: v1.1.0
 """
+import heapq
 import itertools
+import random
+from collections import Counter
+from array import array
+import pytest
 
 class Node:
+    # Slots skip the per-instance __dict__, which is most of a node's memory
+    __slots__ = ("val", "next", "prev")
+
     def __init__(self,val=None,nxt=None,prev=None):
         self.val = val
         self.next = nxt
         self.prev = prev
 
-class DLL:
+class SumOfSquares:
+    """
+    A maintained aggregate holding the sum of the squares of every value in a list.
+    """
+    def __init__(self):
+        self.value = 0
+
+    def add(self, val):
+        self.value += val * val
+
+    def remove(self, val):
+        self.value -= val * val
+
+class LazyHeap:
+    """
+    A min-heap whose removals are only applied once they reach the top. Once the removed values
+    still buried in it outnumber the live ones, it is rebuilt from the live values, so it never
+    holds much more than twice as many values as are actually in it.
+    """
+    def __init__(self):
+        self.heap = []
+        # Values that were removed but are still buried in the heap, and how many there are
+        self.removed = Counter()
+        self.pending = 0
+
+    def __len__(self):
+        return len(self.heap) - self.pending
+
+    def push(self, val):
+        heapq.heappush(self.heap, val)
+
+    def remove(self, val):
+        self.removed[val] += 1
+        self.pending += 1
+
+        if self.pending > len(self):
+            live = []
+            for v in self.heap:
+                if self.removed[v] > 0:
+                    self.removed[v] -= 1
+                else:
+                    live.append(v)
+
+            heapq.heapify(live)
+            self.heap, self.removed, self.pending = live, Counter(), 0
+
+    def top(self):
+        heap, removed = self.heap, self.removed
+
+        while heap and removed[heap[0]] > 0:
+            val = heapq.heappop(heap)
+            removed[val] -= 1
+            if not removed[val]: del removed[val]
+            self.pending -= 1
+
+        return heap[0] if heap else None
+
+class Extremes:
+    """
+    A maintained aggregate holding the minimum and maximum values of a list. Values are kept in
+    a min-heap and a max-heap, and removals are only applied once they reach the top of a heap.
+    """
     def __init__(self):
-        """ Initalizes an empty doubly-linked list. """
+        self.low = LazyHeap()
+        self.high = LazyHeap()
+
+    def add(self, val):
+        self.low.push(val)
+        self.high.push(-val)
+
+    def remove(self, val):
+        self.low.remove(val)
+        self.high.remove(-val)
+
+    def min(self):
+        return self.low.top()
+
+    def max(self):
+        top = self.high.top()
+        return -top if top is not None else None
+
+class DLL:
+    # The class of the nodes the list creates, which subclasses can swap out
+    node = Node
+
+    def __init__(self, aggregates=()):
+        """
+        Initalizes an empty doubly-linked list. Any aggregates, objects with add(val) and
+        remove(val) methods, are updated with every value that enters or leaves the list.
+        """
         self.size = 0
         self.firstNode = None
         self.lastNode = None
         self.sum = 0
+        self.pairsum = 0
+        self.aggregates = list(aggregates)
 
     def length(self):
         """ Returns the number of nodes in the list. """
         return self.size
 
     def __update_internal__(self, delsize, delsum):
+        # The pair products gained or lost by a value are the value times the sum of the others.
+        # For [a,b,c] + d, the new pairs are ad, bd, cd = d(a + b + c), so adding multiplies by the
+        # sum before it changes, and removing by the sum after it changes.
+        if delsize > 0: self.pairsum += delsum * self.sum
         self.size += delsize
         self.sum += delsum
+        if delsize < 0: self.pairsum += delsum * self.sum
+
+        for aggregate in self.aggregates:
+            if delsize > 0:
+                aggregate.add(delsum)
+            else:
+                aggregate.remove(-delsum)
 
     def push(self, val):
         """ Adds a node with value equal to val to the front of the list. """
         # Create a new node
-        node = Node(val=val, nxt=self.firstNode)
+        node = self.node(val=val, nxt=self.firstNode)
 
         # If there is a node in the list
         if self.firstNode:
@@ -44,11 +152,12 @@ class DLL:
         # Update the first node and list size
         self.firstNode = node
         self.__update_internal__(1, val)
+        return node
 
     def insert_after(self, prev_node, val):
         """ Adds a node with value equal to val in the list after prev_node. """
         # Create the new node and insert it into the list
-        n = Node(val=val, nxt=prev_node.next, prev=prev_node)
+        n = self.node(val=val, nxt=prev_node.next, prev=prev_node)
         # Update the rest of the chain's pointers correspondingly
         if prev_node.next: prev_node.next.prev = n
         prev_node.next = n
@@ -59,6 +168,7 @@ class DLL:
 
         # Update the internal size and sum
         self.__update_internal__(1, val)
+        return n
 
     def delete(self, node):
         """ Removes the specified node from the list. """
@@ -96,22 +206,507 @@ class DLL:
         return n
 
     def multiply_all_pairs(self):
-        """ Multiplies all unique pairs of nodes and returns the sum. """
-        prodsum = 0
-        s = self.sum
-        n = self.firstNode
+        """
+        Multiplies all unique pairs of nodes and returns the sum. The sum is maintained as
+        nodes are added and removed, so this is O(1).
+        """
+        return self.pairsum
+
+    @classmethod
+    def from_iterable(cls, iterable, aggregates=()):
+        """ Builds a list holding the values of iterable in order, in a single pass. """
+        dll = cls(aggregates)
+        dll.extend(iterable)
+        return dll
+
+    def extend(self, iterable):
+        """
+        Appends the values of iterable to the end of the list in a single pass, linking the
+        nodes as they are made and updating the size, sum, and pair products once at the end.
+        """
+        node = self.lastNode
+        size = total = pairs = 0
+
+        for val in iterable:
+            n = self.node(val=val, prev=node)
+            if node: node.next = n
+            else: self.firstNode = n
+            node = n
+
+            pairs += val * total
+            total += val
+            size += 1
+
+            for aggregate in self.aggregates:
+                aggregate.add(val)
+
+        self.lastNode = node
+        # Every new value pairs with every old value, which is old sum * new sum
+        self.pairsum += pairs + self.sum * total
+        self.size += size
+        self.sum += total
+
+    def splice(self, prev_node, other):
+        """
+        Moves every node of other into this list after prev_node (or to the front if prev_node
+        is None) in O(1) time, leaving other empty. Any aggregates are updated value by value.
+        """
+        if other.size == 0:
+            return
+
+        first, last = other.firstNode, other.lastNode
+        nxt = prev_node.next if prev_node else self.firstNode
+
+        first.prev = prev_node
+        last.next = nxt
+        if prev_node: prev_node.next = first
+        else: self.firstNode = first
+        if nxt: nxt.prev = last
+        else: self.lastNode = last
+
+        self.pairsum += other.pairsum + self.sum * other.sum
+        self.size += other.size
+        self.sum += other.sum
+        self.__move_aggregates__(first, nxt, other, self)
+
+        other.firstNode = other.lastNode = None
+        other.size = other.sum = other.pairsum = 0
+
+    def concat(self, other):
+        """ Moves every node of other onto the end of this list in O(1) time, leaving other empty. """
+        self.splice(self.lastNode, other)
+
+    def split_at(self, node):
+        """
+        Cuts the list just before node, and returns a new list holding node and everything after
+        it. Only the shorter of the two halves is walked to work out its size and sums, so the
+        cost is O(min(k, n - k)) rather than O(n).
+        """
+        tail = type(self)()
+        before = node.prev
+
+        # Walk out from the cut in both directions at once until one side runs out
+        a, b = node, before
+        while a and b:
+            a, b = a.next, b.prev
+
+        size, total, pairs = self.__measure__(node if a is None else self.firstNode, None if a is None else node)
+
+        if a is not None:
+            # The front was shorter, so the back is whatever is left over
+            size, total = self.size - size, self.sum - total
+            pairs = self.pairsum - pairs - total * (self.sum - total)
+
+        tail.firstNode, tail.lastNode = node, self.lastNode
+        tail.size, tail.sum, tail.pairsum = size, total, pairs
+
+        node.prev = None
+        if before: before.next = None
+        else: self.firstNode = None
+        self.lastNode = before
+
+        self.pairsum -= pairs + total * (self.sum - total)
+        self.size -= size
+        self.sum -= total
+        self.__move_aggregates__(node, None, self, tail)
+        return tail
+
+    @staticmethod
+    def __measure__(node, end):
+        """ Returns the size, sum, and pair products of the nodes from node up to (not including) end. """
+        size = total = pairs = 0
+
+        while node is not end:
+            pairs += node.val * total
+            total += node.val
+            size += 1
+            node = node.next
+
+        return size, total, pairs
+
+    @staticmethod
+    def __move_aggregates__(node, end, source, target):
+        """ Moves the values from node up to end out of source's aggregates and into target's. """
+        if not (source.aggregates or target.aggregates):
+            return
+
+        while node is not end:
+            for aggregate in source.aggregates: aggregate.remove(node.val)
+            for aggregate in target.aggregates: aggregate.add(node.val)
+            node = node.next
+
+
+class IndexedNode(Node):
+    """
+    A list node that is also a node of a randomized balanced tree (a treap) over the list's
+    order, so that it knows how many nodes sit in its subtree.
+    """
+    __slots__ = ("left", "right", "parent", "count", "priority")
+
+    # Priorities come from a generator of their own so they don't use up the global random stream
+    rng = random.Random()
+
+    def __init__(self,val=None,nxt=None,prev=None):
+        super().__init__(val, nxt, prev)
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.count = 1
+        self.priority = self.rng.random()
+
+class IndexedDLL(DLL):
+    """
+    A doubly-linked list with O(log n) positional indexing. Alongside the usual links, the nodes
+    form a treap ordered by list position in which every node counts its subtree, so a position
+    can be found by descending from the root. Pushing, inserting, and deleting keep the tree
+    balanced in O(log n) expected time, and everything else works exactly like DLL.
+    """
+    node = IndexedNode
+
+    def __init__(self, aggregates=()):
+        """ Initalizes an empty indexed doubly-linked list. """
+        super().__init__(aggregates)
+        self.root = None
+
+    @staticmethod
+    def __count__(node):
+        return node.count if node else 0
+
+    def __rotate_up__(self, n):
+        """ Rotates n above its parent, keeping the in-order (list) order of the tree. """
+        p = n.parent
+        g = p.parent
+
+        if n is p.left:
+            p.left = n.right
+            if n.right: n.right.parent = p
+            n.right = p
+        else:
+            p.right = n.left
+            if n.left: n.left.parent = p
+            n.left = p
+
+        p.parent = n
+        n.parent = g
+
+        if g is None:
+            self.root = n
+        elif g.left is p:
+            g.left = n
+        else:
+            g.right = n
+
+        p.count = 1 + self.__count__(p.left) + self.__count__(p.right)
+        n.count = 1 + self.__count__(n.left) + self.__count__(n.right)
+
+    def __attach__(self, node, parent, left):
+        """ Hangs a new node off an empty side of parent, then restores the heap order on priorities. """
+        if parent is None:
+            self.root = node
+            return
+
+        if left:
+            parent.left = node
+        else:
+            parent.right = node
+
+        node.parent = parent
+
+        # Every ancestor gained one node in its subtree
+        while parent:
+            parent.count += 1
+            parent = parent.parent
+
+        while node.parent and node.priority > node.parent.priority:
+            self.__rotate_up__(node)
+
+    def push(self, val):
+        """ Adds a node with value equal to val to the front of the list. """
+        node = super().push(val)
+        # The new first node is the leftmost in the tree, so it goes left of the old first
+        self.__attach__(node, node.next, True)
+        return node
+
+    def insert_after(self, prev_node, val):
+        """ Adds a node with value equal to val in the list after prev_node. """
+        n = super().insert_after(prev_node, val)
+
+        # The new node is prev_node's successor: either prev_node's right child, or if that is taken,
+        # the left child of the old successor, which is the leftmost node of that subtree
+        if prev_node.right is None:
+            self.__attach__(n, prev_node, False)
+        else:
+            self.__attach__(n, n.next, True)
+
+        return n
+
+    def delete(self, node):
+        """ Removes the specified node from the list. """
+        super().delete(node)
+
+        # Rotate the node down until it has at most one child, then splice it out
+        while node.left and node.right:
+            self.__rotate_up__(node.left if node.left.priority > node.right.priority else node.right)
+
+        child = node.left or node.right
+        parent = node.parent
+
+        if child: child.parent = parent
+
+        if parent is None:
+            self.root = child
+        elif parent.left is node:
+            parent.left = child
+        else:
+            parent.right = child
+
+        while parent:
+            parent.count -= 1
+            parent = parent.parent
+
+    def index(self, i):
+        """ Returns the node at position i (i<n) in O(log n) time. """
+        if i >= self.size:
+            raise IndexError("list index out of range")
+
+        n = self.root
+
+        while True:
+            left = self.__count__(n.left)
+
+            if i < left:
+                n = n.left
+            elif i == left:
+                return n
+            else:
+                i -= left + 1
+                n = n.right
+
+    def __join__(self, a, b):
+        """ Joins two treaps where every node of a comes before every node of b, returning the root. """
+        if not a or not b:
+            return a or b
+
+        if a.priority > b.priority:
+            a.right = self.__join__(a.right, b)
+            a.right.parent = a
+            root = a
+        else:
+            b.left = self.__join__(a, b.left)
+            b.left.parent = b
+            root = b
+
+        root.count = 1 + self.__count__(root.left) + self.__count__(root.right)
+        root.parent = None
+        return root
+
+    def __split__(self, t, k):
+        """ Splits a treap into the roots of its first k nodes and the rest. """
+        if not t:
+            return None, None
+
+        if self.__count__(t.left) < k:
+            left, right = self.__split__(t.right, k - self.__count__(t.left) - 1)
+            t.right = left
+            if left: left.parent = t
+            pair = t, right
+        else:
+            left, right = self.__split__(t.left, k)
+            t.left = right
+            if right: right.parent = t
+            pair = left, t
+
+        t.count = 1 + self.__count__(t.left) + self.__count__(t.right)
+        t.parent = None
+        return pair
+
+    def extend(self, iterable):
+        """
+        Appends the values of iterable to the end of the list in a single pass like DLL.extend,
+        then builds a treap over just the new nodes in O(k) and joins it onto the old one.
+        """
+        last = self.lastNode
+        super().extend(iterable)
+        node = last.next if last else self.firstNode
+
+        # The new nodes come in list order, so the tree is built along its right spine: each node
+        # takes the lower priority nodes it passes as its left subtree, which are then complete
+        spine = []
+
+        while node:
+            below = None
+
+            while spine and spine[-1].priority < node.priority:
+                below = spine.pop()
+                below.count = 1 + self.__count__(below.left) + self.__count__(below.right)
+
+            node.left = below
+            if below: below.parent = node
+
+            if spine:
+                spine[-1].right = node
+                node.parent = spine[-1]
+
+            spine.append(node)
+            node = node.next
+
+        for n in reversed(spine):
+            n.count = 1 + self.__count__(n.left) + self.__count__(n.right)
+
+        if spine:
+            self.root = self.__join__(self.root, spine[0])
+
+    def splice(self, prev_node, other):
+        """
+        Moves every node of other, another IndexedDLL, into this list after prev_node (or to the
+        front if prev_node is None) in O(log n) time, leaving other empty.
+        """
+        left, right = self.__split__(self.root, self.position(prev_node) + 1 if prev_node else 0)
+        self.root = self.__join__(self.__join__(left, other.root), right)
+        other.root = None
+        super().splice(prev_node, other)
+
+    def split_at(self, node):
+        """ Cuts the list just before node, and returns a new list holding node and everything after it. """
+        self.root, rest = self.__split__(self.root, self.position(node))
+        tail = super().split_at(node)
+        tail.root = rest
+        return tail
+
+    def position(self, node):
+        """ Returns the position of node in the list in O(log n) time. """
+        i = self.__count__(node.left)
+
+        # Every time we come up from a right child, the parent and its left subtree are before us
+        while node.parent:
+            if node is node.parent.right:
+                i += self.__count__(node.parent.left) + 1
+            node = node.parent
+
+        return i
+
+class ArrayDLL:
+    """
+    A compact doubly-linked list with the same operations as DLL. Rather than one object per
+    node, the values and links of every node live in parallel integer arrays, and a node is
+    just its index into them. Deleted slots are kept on a free list and reused. Values must
+    fit in a signed 64-bit integer.
+    """
+    # Sizes, sums, and aggregates are kept exactly the same way as in DLL
+    __update_internal__ = DLL.__update_internal__
+
+    def __init__(self, aggregates=()):
+        """ Initalizes an empty doubly-linked list, with optional aggregates as in DLL. """
+        self.size = 0
+        self.firstNode = -1
+        self.lastNode = -1
+        self.sum = 0
+        self.pairsum = 0
+        self.aggregates = list(aggregates)
+        self.vals = array("q")
+        self.nexts = array("q")
+        self.prevs = array("q")
+        # Head of the chain of unused slots, linked through `nexts`
+        self.free = -1
+
+    def length(self):
+        """ Returns the number of nodes in the list. """
+        return self.size
+
+    def value(self, node):
+        """ Returns the value stored at node. """
+        return self.vals[node]
+
+    def next_node(self, node):
+        """ Returns the node after node, or -1 if it is the last. """
+        return self.nexts[node]
+
+    def prev_node(self, node):
+        """ Returns the node before node, or -1 if it is the first. """
+        return self.prevs[node]
+
+    def __allocate__(self, val, nxt, prev):
+        """ Stores a new node in a free slot if there is one, or at the end of the arrays. """
+        node = self.free
+
+        if node == -1:
+            node = len(self.vals)
+            self.vals.append(val)
+            self.nexts.append(nxt)
+            self.prevs.append(prev)
+        else:
+            self.free = self.nexts[node]
+            self.vals[node] = val
+            self.nexts[node] = nxt
+            self.prevs[node] = prev
+
+        self.__update_internal__(1, val)
+        return node
+
+    def push(self, val):
+        """ Adds a node with value equal to val to the front of the list and returns it. """
+        node = self.__allocate__(val, self.firstNode, -1)
+
+        if self.firstNode != -1:
+            self.prevs[self.firstNode] = node
+        else:
+            self.lastNode = node
+
+        self.firstNode = node
+        return node
+
+    def insert_after(self, prev_node, val):
+        """ Adds a node with value equal to val in the list after prev_node and returns it. """
+        nxt = self.nexts[prev_node]
+        node = self.__allocate__(val, nxt, prev_node)
+
+        if nxt != -1:
+            self.prevs[nxt] = node
+        else:
+            self.lastNode = node
+
+        self.nexts[prev_node] = node
+        return node
+
+    def delete(self, node):
+        """ Removes the specified node from the list and frees its slot. """
+        nxt, prev = self.nexts[node], self.prevs[node]
+
+        if nxt != -1:
+            self.prevs[nxt] = prev
+        else:
+            self.lastNode = prev
 
-        # Loop through all the nodes in the list, calculating the rolling product sum
-        # along the way. Takes advantage of the distributive principle. For [a,b,c,d]
-        # the pair products are [ab, ac, ad, bc, bd, cd], which can be rearranged as:
-        #   a(b + c + d) + b(c + d) + cd
-        # Making use of this yields a runtime of O(N).
-        while n:
-            s -= n.val
-            prodsum += n.val * s
-            n = n.next
+        if prev != -1:
+            self.nexts[prev] = nxt
+        else:
+            self.firstNode = nxt
+
+        self.__update_internal__(-1, -self.vals[node])
+
+        # Put the slot at the front of the free list
+        self.nexts[node] = self.free
+        self.free = node
+
+    def index(self, i):
+        """
+        Returns the node at position i (i<n). Searchs from the most optimal direction
+        for the given index.
+        """
+        if i >= self.size:
+            raise IndexError("list index out of range")
+        elif i < self.size / 2:
+            n, links, steps = self.firstNode, self.nexts, i
+        else:
+            n, links, steps = self.lastNode, self.prevs, self.size - i - 1
+
+        for j in range(steps): n = links[n]
 
-        return prodsum
+        return n
+
+    def multiply_all_pairs(self):
+        """ Returns the sum of the products of all unique pairs of nodes, maintained as in DLL. """
+        return self.pairsum
 
 
 ###
@@ -174,6 +769,186 @@ def test_dll_multiply():
     dll.insert_after(dll.index(2), 7)
     assert dll.multiply_all_pairs() == 170
 
+def test_array_dll_index():
+    """ Checks whether indexing the array-backed list works from both ends. """
+    dll = ArrayDLL()
+    for v in (42, 41, 40, 39): dll.push(v)
+    assert [dll.value(dll.index(i)) for i in range(4)] == [39, 40, 41, 42]
+
+    with pytest.raises(IndexError):
+        dll.index(4)
+
+def test_array_dll_insert_delete():
+    """ Checks insertion and deletion in the array-backed list, including slot reuse. """
+    dll = ArrayDLL()
+    dll.push(42)
+    dll.push(40)
+    n = dll.insert_after(dll.firstNode, 41)
+    assert dll.value(dll.firstNode) == 40
+    assert dll.value(dll.lastNode) == 42
+    assert dll.prev_node(n) == dll.firstNode
+    assert dll.next_node(n) == dll.lastNode
+
+    dll.delete(n)
+    dll.delete(dll.lastNode)
+    assert dll.length() == 1
+    assert dll.lastNode == dll.firstNode
+    assert dll.value(dll.push(7)) == 7
+    assert len(dll.vals) == 3
+
+def test_array_dll_multiply():
+    """ Checks the array-backed list against the pointer-based one. """
+    dll = ArrayDLL()
+    dll.push(3)
+    dll.push(2)
+    dll.push(1)
+    assert dll.multiply_all_pairs() == 11
+    dll.push(9)
+    dll.insert_after(dll.index(2), 7)
+    assert dll.multiply_all_pairs() == 170
+    assert dll.sum == 22
+
+def test_dll_maintained_aggregates():
+    """ Checks the pair products and other aggregates after every kind of mutation. """
+    rng = random.Random(12)
+    squares = SumOfSquares()
+    extremes = Extremes()
+    dll = DLL(aggregates=[squares, extremes])
+    values = []
+
+    for step in range(500):
+        if rng.random() < 0.6 or not values:
+            v = rng.randint(-50, 50)
+            if values and rng.random() < 0.5:
+                dll.insert_after(dll.index(rng.randrange(len(values))), v)
+            else:
+                dll.push(v)
+            values.append(v)
+        else:
+            node = dll.index(rng.randrange(len(values)))
+            values.remove(node.val)
+            dll.delete(node)
+
+        pairs = sum(a * b for a, b in itertools.combinations(values, 2))
+        assert dll.multiply_all_pairs() == pairs
+        assert squares.value == sum(v * v for v in values)
+        assert extremes.min() == (min(values) if values else None)
+        assert extremes.max() == (max(values) if values else None)
+
+    # removed values don't pile up in the heaps of a long-lived list
+    for v in range(1000): extremes.add(v)
+    for v in range(1000): extremes.remove(v)
+    for v in range(5): extremes.add(v)
+    assert len(extremes.low.heap) <= 2 * (len(values) + 5) + 1
+    assert len(extremes.high.heap) <= 2 * (len(values) + 5) + 1
+    assert extremes.min() == min(values + [0]) and extremes.max() == max(values + [4])
+
+def test_indexed_dll_keeps_global_random():
+    """ Checks that building an indexed list doesn't advance the caller's random stream. """
+    random.seed(5)
+    expected = random.random()
+
+    random.seed(5)
+    dll = IndexedDLL()
+    for v in range(100): dll.push(v)
+    assert random.random() == expected
+
+def test_indexed_dll_matches_list():
+    """ Runs random pushes, inserts, and deletes against a Python list and compares positions. """
+    rng = random.Random(2020)
+    dll = IndexedDLL()
+    expected = []
+
+    for step in range(2000):
+        op = rng.random()
+
+        if op < 0.3 or not expected:
+            dll.push(step)
+            expected.insert(0, step)
+        elif op < 0.7:
+            i = rng.randrange(len(expected))
+            dll.insert_after(dll.index(i), step)
+            expected.insert(i + 1, step)
+        else:
+            i = rng.randrange(len(expected))
+            node = dll.index(i)
+            assert dll.position(node) == i
+            dll.delete(node)
+            del expected[i]
+
+        assert dll.length() == len(expected)
+
+    assert [dll.index(i).val for i in range(len(expected))] == expected
+    assert dll.sum == sum(expected)
+
+def test_indexed_dll_multiply():
+    """ Checks that the indexed list still keeps its links and sum for pairwise multiplication. """
+    dll = IndexedDLL()
+    dll.push(3)
+    dll.push(2)
+    dll.push(1)
+    assert dll.multiply_all_pairs() == 11
+    dll.push(9)
+    dll.insert_after(dll.index(2), 7)
+    assert dll.multiply_all_pairs() == 170
+    assert dll.index(3).val == 7
+
+def check_dll(dll, expected):
+    """ Asserts that a list holds exactly the expected values, linked both ways, with correct totals. """
+    forward, n = [], dll.firstNode
+    while n: forward.append(n.val); n = n.next
+    backward, n = [], dll.lastNode
+    while n: backward.append(n.val); n = n.prev
+
+    assert forward == expected
+    assert backward == expected[::-1]
+    assert dll.length() == len(expected)
+    assert dll.sum == sum(expected)
+    assert dll.multiply_all_pairs() == sum(a * b for a, b in itertools.combinations(expected, 2))
+
+@pytest.mark.parametrize("cls", [DLL, IndexedDLL])
+def test_dll_bulk_operations(cls):
+    """ Checks bulk building, splicing, concatenation, and splitting against Python lists. """
+    rng = random.Random(7)
+
+    for trial in range(50):
+        a = [rng.randint(-9, 9) for _ in range(rng.randrange(8))]
+        b = [rng.randint(-9, 9) for _ in range(rng.randrange(8))]
+        x, y = cls.from_iterable(a), cls.from_iterable(b)
+        check_dll(x, a)
+
+        # splice b after a random node of a (or at the front)
+        i = rng.randrange(len(a) + 1)
+        x.splice(x.index(i - 1) if i else None, y)
+        a[i:i] = b
+        check_dll(x, a)
+        check_dll(y, [])
+
+        x.extend([1, 2, 3])
+        x.concat(cls.from_iterable([4, 5]))
+        a += [1, 2, 3, 4, 5]
+        check_dll(x, a)
+
+        # split at a random node, and make sure both halves still work
+        i = rng.randrange(len(a))
+        tail = x.split_at(x.index(i))
+        check_dll(x, a[:i])
+        check_dll(tail, a[i:])
+
+        if cls is IndexedDLL:
+            assert [tail.index(j).val for j in range(len(a) - i)] == a[i:]
+            assert [x.index(j).val for j in range(i)] == a[:i]
+
+    if cls is IndexedDLL:
+        # a bulk built treap is still a treap: heap ordered on priorities, with correct counts
+        dll = cls.from_iterable(range(500))
+        dll.extend(range(500, 1000))
+        nodes = [dll.index(j) for j in range(1000)]
+        assert [n.val for n in nodes] == list(range(1000)) and dll.root.parent is None
+        for n in nodes:
+            assert n.count == 1 + cls.__count__(n.left) + cls.__count__(n.right)
+            assert all(child.parent is n and child.priority <= n.priority for child in (n.left, n.right) if child)
+
 
 ###
 ### PERFORMANCE SECTION
@@ -184,8 +959,29 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import random
 import timeit
+import tracemalloc
+
+def compare_compact(n=10**6):
+    """
+    Compares the memory per node and the time to push n values and multiply all pairs between
+    the pointer-based DLL and the array-backed ArrayDLL.
+    """
+    for cls in (DLL, ArrayDLL):
+        tracemalloc.start()
+        l = cls()
+        push = timeit.timeit("for i in range(n): l.push(i)", number=1, globals=locals())
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        multiply = timeit.timeit("l.multiply_all_pairs()", number=5, globals=locals()) / 5
+
+        print(cls.__name__ + ":")
+        print(" --> bytes per node:", memory / n)
+        print(" --> push time (s):", push)
+        print(" --> multiply_all_pairs time (s):", multiply)
 
 if __name__ == "__main__":
+    compare_compact()
+
     sns.set(style="darkgrid")
     f = plt.figure()
     xs = range(10, 10001, 10)
@@ -1,10 +1,18 @@
 """
-Implements a queue with minimum-value tracking capabailities using a doubly-linked list.
+Implements a queue with minimum-value tracking capabailities using a ring buffer, along with
+the doubly-linked list it was originally built on.
 
 @author: Elias Gabriel
-@revision: v1.0.0
+@revision: v1.1.0
 """
+import asyncio
 import itertools
+import queue
+import random
+import threading
+import time
+import numpy as np
+import pytest
 
 class DLL:
     class Node:
@@ -92,55 +100,368 @@ class DLL:
             n = self.tail
             for j in range(self.size - i - 1): n = n.prev
         
-        return np
+        return n
+
+    @classmethod
+    def from_iterable(cls, iterable):
+        """ Builds a list holding the values of iterable in order, in a single pass. """
+        dll = cls()
+        dll.extend(iterable)
+        return dll
+
+    def extend(self, iterable):
+        """ Appends the values of iterable to the tail of the list in a single pass. """
+        node = self.tail
+        size = 0
+
+        for val in iterable:
+            n = DLL.Node(val=val, prev=node)
+            if node: node.next = n
+            else: self.head = n
+            node = n
+            size += 1
+
+        self.tail = node
+        self.size += size
+
+    def splice(self, prev_node, other):
+        """
+        Moves every node of other into this list after prev_node (or to the head if prev_node
+        is None) in O(1) time, leaving other empty.
+        """
+        if other.size == 0:
+            return
+
+        nxt = prev_node.next if prev_node else self.head
+        other.head.prev = prev_node
+        other.tail.next = nxt
+
+        if prev_node: prev_node.next = other.head
+        else: self.head = other.head
+        if nxt: nxt.prev = other.tail
+        else: self.tail = other.tail
 
-class Queue:
+        self.size += other.size
+        other.head = other.tail = None
+        other.size = 0
+
+    def concat(self, other):
+        """ Moves every node of other onto the tail of this list in O(1) time, leaving other empty. """
+        self.splice(self.tail, other)
+
+    def split_at(self, node):
+        """
+        Cuts the list just before node, and returns a new list holding node and everything after
+        it. Only the shorter half is walked to count it, so the cost is O(min(k, n - k)).
+        """
+        rest = DLL()
+        before = node.prev
+
+        # Walk out from the cut in both directions at once until one side runs out
+        a, b, steps = node, before, 0
+        while a and b:
+            a, b, steps = a.next, b.prev, steps + 1
+
+        # Whichever side ran out first has exactly `steps` nodes
+        rest.size = steps if a is None else self.size - steps
+        rest.head, rest.tail = node, self.tail
+
+        node.prev = None
+        if before: before.next = None
+        else: self.head = None
+        self.tail = before
+        self.size -= rest.size
+        return rest
+
+class MinQueue:
     """
-    A doubly-linked list-backed queue implementation.
+    A queue with minimum and maximum tracking built on a preallocated ring buffer. Alongside
+    the values, two monotonic deques (also ring buffers) hold the positions of the values that
+    could still become the minimum or maximum, so every operation is amortized O(1). The buffers
+    double in size when full, which never happens when the capacity covers the largest window.
     """
 
-    def __init__(self):
-        """ Initializes the queue using an internal doubly-linked list and list of minimum values. """
-        self.internal = DLL()
-        self.mval = None
-        self.mins = []
+    def __init__(self, capacity=16):
+        """ Initializes an empty queue with room for capacity values. """
+        self.capacity = max(1, capacity)
+        self.values = [None] * self.capacity
+        # Positions (counted from the first value ever enqueued) of the oldest value and the
+        # next free slot, so the queue holds positions head..tail-1
+        self.head = self.tail = 0
+        # Deques of positions whose values increase (mins) or decrease (maxs) from front to back
+        self.mins = [0] * self.capacity
+        self.maxs = [0] * self.capacity
+        self.mins_head = self.mins_tail = 0
+        self.maxs_head = self.maxs_tail = 0
 
     def __len__(self):
         """ Override Python's default len() operation to return a valid result. """
-        return len(self.internal)
+        return self.tail - self.head
+
+    def __grow__(self):
+        """ Doubles every buffer, moving each entry to its slot for the new capacity. """
+        old, new = self.capacity, self.capacity * 2
+        values, mins, maxs = [None] * new, [0] * new, [0] * new
+
+        for i in range(self.head, self.tail): values[i % new] = self.values[i % old]
+        for i in range(self.mins_head, self.mins_tail): mins[i % new] = self.mins[i % old]
+        for i in range(self.maxs_head, self.maxs_tail): maxs[i % new] = self.maxs[i % old]
+
+        self.capacity, self.values, self.mins, self.maxs = new, values, mins, maxs
 
     def enqueue(self, val):
-        """ Pushes the given element onto the beginning of the queue. """
-        # dispatch the push operation to the dll
-        self.internal.push(val)
-        i = -1
+        """ Pushes the given element onto the back of the queue. """
+        if self.tail - self.head == self.capacity:
+            self.__grow__()
+
+        cap, values, tail = self.capacity, self.values, self.tail
+        values[tail % cap] = val
 
-        for i in range(len(self.mins) - 1, -1, -1):
-            if val >= self.mins[i]:
-                break
+        # Anything larger (smaller) than the new value can never be the minimum (maximum) again
+        mins, t = self.mins, self.mins_tail
+        while t > self.mins_head and values[mins[(t - 1) % cap] % cap] > val: t -= 1
+        mins[t % cap] = tail
+        self.mins_tail = t + 1
 
-        # prune the minimum list
-        if i != -1: del self.mins[i:]
+        maxs, t = self.maxs, self.maxs_tail
+        while t > self.maxs_head and values[maxs[(t - 1) % cap] % cap] < val: t -= 1
+        maxs[t % cap] = tail
+        self.maxs_tail = t + 1
 
-        # add the new minimum to the list
-        self.mins.append(val)
+        self.tail = tail + 1
 
-        print(self.mins)
+    def enqueue_many(self, vals):
+        """ Pushes every value of vals onto the back of the queue, in order. """
+        # Grow once up front rather than part way through when we know how many are coming
+        if hasattr(vals, "__len__"):
+            while self.tail - self.head + len(vals) > self.capacity:
+                self.__grow__()
+
+        enqueue = self.enqueue
+        for val in vals: enqueue(val)
 
     def dequeue(self):
-        """ Removes the last element from the queue in the order of enqueueing. """
-        oldest = self.internal.tail
-        self.internal.delete(oldest)
-        
-        # update the minimum list if necessary
-        if oldest.val == self.mins[-1]:
-            self.mins.pop()
+        """ Removes and returns the oldest element in the queue. """
+        if self.tail == self.head:
+            raise IndexError("dequeue from an empty queue")
+
+        cap, head = self.capacity, self.head
+        val = self.values[head % cap]
+        # Drop the reference so the buffer doesn't keep the value alive
+        self.values[head % cap] = None
+
+        if self.mins[self.mins_head % cap] == head: self.mins_head += 1
+        if self.maxs[self.maxs_head % cap] == head: self.maxs_head += 1
+
+        self.head = head + 1
+        return val
+
+    def find_min(self):
+        """ Returns the minimum value of the queue, or None if it is empty. """
+        if self.tail == self.head:
+            return None
+
+        return self.values[self.mins[self.mins_head % self.capacity] % self.capacity]
+
+    def find_max(self):
+        """ Returns the maximum value of the queue, or None if it is empty. """
+        if self.tail == self.head:
+            return None
+
+        return self.values[self.maxs[self.maxs_head % self.capacity] % self.capacity]
+
+
+# The min-tracking queue used to be backed by the DLL above, and kept its name
+Queue = MinQueue
 
-        return oldest.val
+
+class ConcurrentMinQueue:
+    """
+    A bounded, thread-safe MinQueue. One lock guards the queue, and producers block (or time out)
+    while it is full, which pushes back on them instead of letting the queue grow. The minimum
+    and maximum are republished together after every change, so reading them never takes the
+    lock.
+    """
+
+    def __init__(self, maxsize):
+        """ Initializes an empty queue that holds at most maxsize values. """
+        self.maxsize = maxsize
+        self.queue = MinQueue(maxsize)
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.extremes = (None, None)
+
+    def __len__(self):
+        """ Override Python's default len() operation to return a valid result. """
+        return len(self.queue)
+
+    def __publish__(self):
+        # Both values go out in one attribute store, which is atomic, so readers see either the
+        # old pair or the new one and never a minimum and maximum from different states
+        self.extremes = (self.queue.find_min(), self.queue.find_max())
+
+    def put(self, val, timeout=None):
+        """ Adds a value to the back of the queue, waiting for room. Raises queue.Full on timeout. """
+        with self.not_full:
+            if not self.not_full.wait_for(lambda: len(self.queue) < self.maxsize, timeout):
+                raise queue.Full
+
+            self.queue.enqueue(val)
+            self.__publish__()
+            self.not_empty.notify()
+
+    def put_many(self, vals, timeout=None):
+        """
+        Adds every value to the back of the queue in order, taking the lock once for as many values
+        as fit at a time. Raises queue.Full if it has to wait longer than timeout for room.
+        """
+        vals = list(vals)
+        i = 0
+
+        while i < len(vals):
+            with self.not_full:
+                if not self.not_full.wait_for(lambda: len(self.queue) < self.maxsize, timeout):
+                    raise queue.Full
+
+                room = self.maxsize - len(self.queue)
+                self.queue.enqueue_many(vals[i:i + room])
+                i += room
+                self.__publish__()
+                self.not_empty.notify_all()
+
+    def get(self, timeout=None):
+        """ Removes and returns the oldest value, waiting for one. Raises queue.Empty on timeout. """
+        with self.not_empty:
+            if not self.not_empty.wait_for(lambda: len(self.queue) > 0, timeout):
+                raise queue.Empty
+
+            val = self.queue.dequeue()
+            self.__publish__()
+            self.not_full.notify()
+            return val
+
+    def find_min(self):
+        """ Returns the minimum value of the queue, or None if it is empty, without locking. """
+        return self.extremes[0]
+
+    def find_max(self):
+        """ Returns the maximum value of the queue, or None if it is empty, without locking. """
+        return self.extremes[1]
+
+    def find_extremes(self):
+        """ Returns the (minimum, maximum) of the queue from the same moment, without locking. """
+        return self.extremes
+
+class AsyncMinQueue:
+    """
+    A bounded MinQueue for asyncio. put() waits while the queue is full and get() while it is
+    empty, and find_min/find_max are plain O(1) reads that never wait.
+    """
+
+    def __init__(self, maxsize):
+        """ Initializes an empty queue that holds at most maxsize values. """
+        self.maxsize = maxsize
+        self.queue = MinQueue(maxsize)
+        lock = asyncio.Lock()
+        self.not_empty = asyncio.Condition(lock)
+        self.not_full = asyncio.Condition(lock)
+
+    def __len__(self):
+        """ Override Python's default len() operation to return a valid result. """
+        return len(self.queue)
+
+    async def put(self, val):
+        """ Adds a value to the back of the queue, waiting for room. """
+        async with self.not_full:
+            await self.not_full.wait_for(lambda: len(self.queue) < self.maxsize)
+            self.queue.enqueue(val)
+            self.not_empty.notify()
+
+    async def get(self):
+        """ Removes and returns the oldest value, waiting for one. """
+        async with self.not_empty:
+            await self.not_empty.wait_for(lambda: len(self.queue) > 0)
+            val = self.queue.dequeue()
+            self.not_full.notify()
+            return val
 
     def find_min(self):
-        """ Returns the minimum value of the queue. """
-        return self.mins[0]
+        """ Returns the minimum value of the queue, or None if it is empty. """
+        return self.queue.find_min()
+
+    def find_max(self):
+        """ Returns the maximum value of the queue, or None if it is empty. """
+        return self.queue.find_max()
+
+
+def _window_reduce(a, window, ufunc):
+    """
+    Reduces every window of a with ufunc (np.minimum or np.maximum) using the van Herk/Gil-Werman
+    method: split the array into blocks of the window size, take running reductions forwards and
+    backwards within each block, and combine the two at every window. This is O(n) and runs
+    entirely inside NumPy, whatever the window size.
+    """
+    a = np.asarray(a)
+    n = len(a)
+
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    if n < window:
+        return a[:0].copy()
+
+    # Pad the last block with a value that never wins the reduction
+    if np.issubdtype(a.dtype, np.integer):
+        info = np.iinfo(a.dtype)
+        fill = info.max if ufunc is np.minimum else info.min
+    else:
+        fill = np.inf if ufunc is np.minimum else -np.inf
+
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, fill, dtype=a.dtype)
+    padded[:n] = a
+    padded = padded.reshape(blocks, window)
+
+    # prefix[i] reduces from the start of i's block up to i, suffix[i] from i to the end of its block
+    prefix = ufunc.accumulate(padded, axis=1).ravel()
+    suffix = ufunc.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    # The window starting at i is the end of i's block plus the start of the next
+    return ufunc(suffix[:n - window + 1], prefix[window - 1:n])
+
+def sliding_min(a, window):
+    """
+    Returns the minimum of every full window of a, the same values find_min gives after each
+    enqueue once a MinQueue holds window values and dequeues one for every new one.
+    """
+    return _window_reduce(a, window, np.minimum)
+
+def sliding_max(a, window):
+    """ Returns the maximum of every full window of a, see sliding_min. """
+    return _window_reduce(a, window, np.maximum)
+
+class SlidingWindow:
+    """
+    Computes window minimums and maximums over a stream of arrays, chunk by chunk. The last
+    window - 1 samples of each chunk are carried over to the next, which is exactly the state a
+    MinQueue would hold, so windows spanning a chunk boundary are reported as if the stream
+    were one array.
+    """
+
+    def __init__(self, window):
+        """ Initializes an empty stream with the given window size. """
+        if window < 1:
+            raise ValueError("window must be at least 1")
+
+        self.window = window
+        self.carry = None
+
+    def update(self, chunk):
+        """ Adds a chunk to the stream and returns the (mins, maxs) of the windows that end in it. """
+        chunk = np.asarray(chunk)
+        data = chunk if self.carry is None else np.concatenate((self.carry, chunk))
+        self.carry = data[max(0, len(data) - self.window + 1):].copy() if self.window > 1 else data[:0]
+        return sliding_min(data, self.window), sliding_max(data, self.window)
 
 
 ##
@@ -148,6 +469,123 @@ class Queue:
 ##
 
 
+def test_dll_bulk_operations():
+    """ Checks bulk building, splicing, concatenation, and splitting against Python lists. """
+    def values(dll):
+        forward, n = [], dll.head
+        while n: forward.append(n.val); n = n.next
+        backward, n = [], dll.tail
+        while n: backward.append(n.val); n = n.prev
+        assert forward == backward[::-1]
+        assert len(dll) == len(forward)
+        return forward
+
+    a = DLL.from_iterable([1, 2, 3])
+    a.splice(a.head, DLL.from_iterable([8, 9]))
+    a.splice(None, DLL.from_iterable([0]))
+    a.concat(DLL.from_iterable([4, 5]))
+    a.extend([6])
+    assert values(a) == [0, 1, 8, 9, 2, 3, 4, 5, 6]
+
+    # cut near the back, near the front, and at the head
+    b = a.split_at(a.tail.prev)
+    assert values(a) == [0, 1, 8, 9, 2, 3, 4] and values(b) == [5, 6]
+    c = a.split_at(a.head.next)
+    assert values(a) == [0] and values(c) == [1, 8, 9, 2, 3, 4]
+    d = a.split_at(a.head)
+    assert values(a) == [] and values(d) == [0]
+
+def test_min_queue_sliding_window():
+    """ Compares window minimums and maximums against brute force, growing the buffer on the way. """
+    rng = random.Random(3)
+    queue = MinQueue(capacity=2)
+    window = []
+
+    for step in range(2000):
+        if rng.random() < 0.55 or not window:
+            vals = [rng.randint(-20, 20) for _ in range(rng.randrange(1, 4))]
+            queue.enqueue_many(vals)
+            window += vals
+        else:
+            assert queue.dequeue() == window.pop(0)
+
+        assert len(queue) == len(window)
+        assert queue.find_min() == (min(window) if window else None)
+        assert queue.find_max() == (max(window) if window else None)
+
+def test_min_queue_empty():
+    """ Checks that an empty queue reports no minimum and refuses to dequeue. """
+    queue = MinQueue()
+    assert queue.find_min() is None and queue.find_max() is None
+
+    with pytest.raises(IndexError):
+        queue.dequeue()
+
+def test_sliding_window_matches_queue():
+    """ Checks the vectorized window minimums and maximums against a MinQueue over the same stream. """
+    rng = np.random.default_rng(5)
+
+    for window in (1, 2, 5, 17):
+        a = rng.integers(-100, 100, size=300)
+        queue = MinQueue()
+        mins, maxs = [], []
+
+        for val in a:
+            queue.enqueue(val)
+            if len(queue) > window: queue.dequeue()
+            if len(queue) == window:
+                mins.append(queue.find_min())
+                maxs.append(queue.find_max())
+
+        assert np.array_equal(sliding_min(a, window), mins)
+        assert np.array_equal(sliding_max(a.astype(float), window), maxs)
+
+        # feed the same stream in uneven chunks, some shorter than the window
+        stream = SlidingWindow(window)
+        parts = [stream.update(chunk) for chunk in np.split(a, [3, 4, 50, 51, 200])]
+        assert np.array_equal(np.concatenate([p[0] for p in parts]), mins)
+        assert np.array_equal(np.concatenate([p[1] for p in parts]), maxs)
+
+def test_concurrent_min_queue():
+    """ Runs several producers against one consumer through a small queue and checks every value arrives. """
+    q = ConcurrentMinQueue(8)
+    producers = [threading.Thread(target=lambda k=k: [q.put(k * 1000 + i) for i in range(500)]) for k in range(4)]
+    batch = threading.Thread(target=lambda: q.put_many(range(-500, 0)))
+    received = []
+
+    for t in producers + [batch]: t.start()
+
+    for _ in range(2500):
+        received.append(q.get(timeout=5))
+        assert len(q) <= 8
+
+    for t in producers + [batch]: t.join()
+
+    assert sorted(received) == sorted(list(range(-500, 0)) + [k * 1000 + i for k in range(4) for i in range(500)])
+    assert q.find_min() is None and q.find_extremes() == (None, None)
+
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+def test_async_min_queue():
+    """ Checks backpressure and ordering of the asyncio queue. """
+    async def run():
+        q = AsyncMinQueue(2)
+        await q.put(3)
+        await q.put(1)
+
+        # the queue is full, so a third put has to wait for a get
+        pending = asyncio.ensure_future(q.put(2))
+        await asyncio.sleep(0)
+        assert not pending.done() and q.find_min() == 1
+
+        assert await q.get() == 3
+        await pending
+        assert q.find_min() == 1 and q.find_max() == 2
+        return [await q.get(), await q.get()]
+
+    assert asyncio.run(run()) == [1, 2]
+
 def test_queue_enqueue():
     """ Performs several enqueue operations and asserts runtime conditions. """
     queue = Queue()
@@ -179,3 +617,40 @@ def test_queue_dequeue_fmin():
     assert queue.find_min() == -2
     queue.dequeue()
     assert queue.find_min() == -2
+
+
+##
+## PERFORMANCE
+##
+
+
+def contention_benchmark(producers=(1, 2, 4, 8), items=200000, maxsize=1024):
+    """
+    Measures the throughput of a single consumer against an increasing number of producer threads
+    and prints the values per second for each. Producers send their share of the items one put()
+    at a time, which is where they fight over the lock, and then in batches with put_many(). A
+    plain queue.Queue taking the same per-item puts is the baseline.
+    """
+    modes = {
+        "queue.Queue put": (lambda: queue.Queue(maxsize), lambda q, vals: [q.put(v) for v in vals]),
+        "put": (lambda: ConcurrentMinQueue(maxsize), lambda q, vals: [q.put(v) for v in vals]),
+        "put_many": (lambda: ConcurrentMinQueue(maxsize), lambda q, vals: q.put_many(vals))
+    }
+
+    for count in producers:
+        share = items // count
+
+        for mode, (make, produce) in modes.items():
+            q = make()
+            threads = [threading.Thread(target=produce, args=(q, range(share))) for _ in range(count)]
+            base = time.perf_counter()
+
+            for t in threads: t.start()
+            for _ in range(share * count): q.get()
+            for t in threads: t.join()
+
+            print(count, "producers,", mode + ":", round(share * count / (time.perf_counter() - base)), "values/s")
+
+
+if __name__ == "__main__":
+    contention_benchmark()
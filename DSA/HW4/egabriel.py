@@ -3,7 +3,12 @@ Solves the Maximum Consecutive Subarray problem using a divide and conquer metho
 
 @author: Elias Gabriel
 """
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import reduce
 import numpy as np
+import pytest
 
 def brange(scores, start, end):
     if start == end: return start, end, scores[start]
@@ -54,6 +59,310 @@ def brange(scores, start, end):
         return mid, end + 1, c[2]
 
 
+def kadane_rows(scores):
+    """
+    Finds the maximum subarray of every row of a 2D array at once in O(n) per row. The best
+    subarray ending at j is the prefix sum up to j minus the smallest prefix sum before it, so
+    running minimums over the prefix sums give every row's answer without a Python-level loop.
+    Returns arrays of starts, (exclusive) ends, and sums, one entry per row.
+    """
+    scores = np.asarray(scores)
+
+    if scores.ndim != 2 or scores.shape[1] == 0:
+        raise ValueError("expected a 2D array with at least one column")
+
+    rows, n = scores.shape
+    prefix = np.zeros((rows, n + 1), dtype=np.result_type(scores.dtype, np.int64))
+    np.cumsum(scores, axis=1, out=prefix[:, 1:])
+
+    # smallest prefix sum before each end, and the latest position it was reached at
+    lows = np.minimum.accumulate(prefix[:, :-1], axis=1)
+    positions = np.where(prefix[:, :-1] == lows, np.arange(n), 0)
+    np.maximum.accumulate(positions, axis=1, out=positions)
+
+    best = prefix[:, 1:] - lows
+    ends = np.argmax(best, axis=1)
+    everything = np.arange(rows)
+
+    return positions[everything, ends], ends + 1, best[everything, ends]
+
+def kadane(scores):
+    """
+    Finds the maximum subarray of scores in O(n) time, returning the same (start, end, sum)
+    tuple as brange with an exclusive end.
+    """
+    starts, ends, sums = kadane_rows(np.asarray(scores)[np.newaxis, :])
+    return int(starts[0]), int(ends[0]), sums[0].item()
+
+
+class StreamingMaxSubarray:
+    """
+    Finds the maximum subarray of a sequence that arrives in chunks, keeping only O(1) state
+    between them: how many values came before, their total, the smallest prefix sum so far and
+    where it was, and the best subarray so far. Each chunk is processed with the same prefix
+    sum method as kadane_rows, and all indices are global positions in the whole sequence.
+    """
+
+    def __init__(self):
+        """ Initializes an empty stream. """
+        self.offset = 0
+        self.total = 0
+        # The smallest prefix sum up to and including the current position, starting with the
+        # empty prefix before the first value
+        self.low = 0
+        self.low_at = 0
+        self.best = None
+
+    def update(self, chunk):
+        """ Adds the next chunk of the sequence. """
+        chunk = np.asarray(chunk).ravel()
+        m = len(chunk)
+
+        if m == 0:
+            return
+
+        prefix = self.total + np.cumsum(chunk, dtype=np.result_type(chunk.dtype, np.int64))
+
+        # Prefix sums that a subarray ending in this chunk could start after, led by the carried minimum
+        candidates = np.concatenate(([self.low], prefix[:-1]))
+        where = np.concatenate(([self.low_at], self.offset + 1 + np.arange(m - 1)))
+        lows = np.minimum.accumulate(candidates)
+        latest = np.where(candidates == lows, np.arange(m), 0)
+        np.maximum.accumulate(latest, out=latest)
+
+        gains = prefix - lows
+        j = int(np.argmax(gains))
+
+        if self.best is None or gains[j] > self.best[2]:
+            self.best = int(where[latest[j]]), self.offset + j + 1, gains[j].item()
+
+        # Carry the smallest prefix sum forward, including the one at the end of this chunk
+        if prefix[-1] <= lows[-1]:
+            self.low, self.low_at = prefix[-1], self.offset + m
+        else:
+            self.low, self.low_at = lows[-1], int(where[latest[-1]])
+
+        self.total = prefix[-1]
+        self.offset += m
+
+    def result(self):
+        """ Returns the (start, end, sum) of the best subarray seen so far, with an exclusive end. """
+        return self.best
+
+def iter_chunks(source, chunk_size=2**20, dtype=np.float64):
+    """
+    Yields a sequence in chunks of at most chunk_size values. The source can be an array
+    (including an np.memmap, which is only read a chunk at a time), the path to a raw binary
+    file of the given dtype, or any iterable that already yields chunks.
+    """
+    if isinstance(source, np.ndarray):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            while True:
+                chunk = np.fromfile(f, dtype=dtype, count=chunk_size)
+                if len(chunk) == 0: break
+                yield chunk
+    else:
+        yield from source
+
+def stream_max_subarray(source, chunk_size=2**20, dtype=np.float64):
+    """
+    Finds the maximum subarray of a sequence too large to hold in memory, reading it chunk by
+    chunk from any source iter_chunks accepts. Returns (start, end, sum) like brange.
+    """
+    stream = StreamingMaxSubarray()
+
+    for chunk in iter_chunks(source, chunk_size, dtype):
+        stream.update(chunk)
+
+    return stream.result()
+
+
+# Everything needed to combine a segment with its neighbours, the same three cases brange
+# checks: the best subarray touching the left edge (prefix), touching the right edge (suffix),
+# and anywhere inside (best). Indices are global, and ends are exclusive. Ties always go to the
+# shortest prefix and suffix, and to the best subarray ending first (then the shortest of
+# those), so the indices found don't depend on how the scores were split up.
+Summary = namedtuple("Summary", "total prefix prefix_end suffix suffix_start best best_start best_end")
+
+def summarize(scores, offset=0):
+    """ Reduces a non-empty segment starting at global index offset to its Summary in O(n). """
+    scores = np.asarray(scores)
+    sums = np.cumsum(scores, dtype=np.result_type(scores.dtype, np.int64))
+    total = sums[-1]
+
+    # best prefix ends at the largest running sum, best suffix starts after the smallest one
+    pre = int(np.argmax(sums))
+    before = np.concatenate(([0], sums[:-1]))
+    suf = len(before) - 1 - int(np.argmin(before[::-1]))
+
+    # the best inner subarray, found from the same running sums exactly as kadane_rows does
+    lows = np.minimum.accumulate(before)
+    latest = np.where(before == lows, np.arange(len(before)), 0)
+    np.maximum.accumulate(latest, out=latest)
+    end = int(np.argmax(sums - lows))
+
+    return Summary(total.item(), sums[pre].item(), offset + pre + 1, (total - before[suf]).item(),
+                   offset + suf, (sums[end] - lows[end]).item(), offset + int(latest[end]), offset + end + 1)
+
+def combine(a, b):
+    """
+    Combines the summaries of two adjacent segments, a directly before b, into the summary of
+    both. This is brange's left/right/crossing step, and it is associative, so segments can be
+    combined in any grouping.
+    """
+    total = a.total + b.total
+
+    if a.total + b.prefix > a.prefix:
+        prefix, prefix_end = a.total + b.prefix, b.prefix_end
+    else:
+        prefix, prefix_end = a.prefix, a.prefix_end
+
+    if b.total + a.suffix > b.suffix:
+        suffix, suffix_start = b.total + a.suffix, a.suffix_start
+    else:
+        suffix, suffix_start = b.suffix, b.suffix_start
+
+    # the best is fully on the left, fully on the right, or across the middle
+    best = max((a.best, a.best_start, a.best_end),
+               (a.suffix + b.prefix, a.suffix_start, b.prefix_end),
+               (b.best, b.best_start, b.best_end),
+               key=lambda candidate: (candidate[0], -candidate[2], candidate[1]))
+
+    return Summary(total, prefix, prefix_end, suffix, suffix_start, *best)
+
+def parallel_max_subarray(scores, workers=None, shards=None, processes=False):
+    """
+    Finds the maximum subarray by splitting scores into shards, summarizing each shard on its own
+    worker, and combining the summaries. Threads are used by default, since NumPy releases the GIL
+    while it works and the shards don't need to be copied; processes=True uses worker processes
+    instead. Returns (start, end, sum) like brange.
+    """
+    scores = np.asarray(scores)
+    workers = workers or os.cpu_count()
+    shards = min(shards or workers, len(scores))
+    bounds = [int(b) for b in np.linspace(0, len(scores), shards + 1)]
+
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(workers) as pool:
+        summaries = pool.map(summarize, [scores[a:b] for a, b in zip(bounds, bounds[1:])], bounds[:-1])
+        result = reduce(combine, summaries)
+
+    return result.best_start, result.best_end, result.best
+
+
+class SegmentTree:
+    """
+    A segment tree over a score array that answers "best subarray of scores[start..end]" in
+    O(log n) and takes point updates in O(log n), so edited arrays don't need brange run again
+    from scratch. Every node holds a Summary of its segment, built with the same combine step
+    as parallel_max_subarray. Nodes are stored column by column in NumPy arrays using the
+    2n layout (the leaves are n..2n-1 and node i's children are 2i and 2i+1), which keeps a
+    10^7 element tree under a gigabyte.
+    """
+    FIELDS = Summary._fields
+
+    def __init__(self, scores):
+        """ Builds the tree from a non-empty array of scores in O(n). """
+        scores = np.asarray(scores)
+        n = self.n = len(scores)
+
+        if n == 0:
+            raise ValueError("cannot build a tree over an empty array")
+
+        values = np.result_type(scores.dtype, np.int64)
+        indices = np.int32 if 2 * n < 2**31 else np.int64
+        self.nodes = {f: np.zeros(2 * n, dtype=indices if f.endswith(("_end", "_start")) else values) for f in self.FIELDS}
+
+        # A leaf's best prefix, suffix, and subarray are all just itself
+        positions = np.arange(n)
+        for f in ("total", "prefix", "suffix", "best"): self.nodes[f][n:] = scores
+        for f in ("suffix_start", "best_start"): self.nodes[f][n:] = positions
+        for f in ("prefix_end", "best_end"): self.nodes[f][n:] = positions + 1
+
+        # Build one level at a time, from the deepest internal nodes up, all at once per level
+        top = n
+        while top > 1:
+            bottom = max(1, top // 2)
+            self.__combine_range__(np.arange(bottom, top))
+            top = bottom
+
+    def __combine_range__(self, i):
+        """ Recomputes the nodes at indices i from their children: combine, for arrays of nodes. """
+        a = {f: column[2 * i] for f, column in self.nodes.items()}
+        b = {f: column[2 * i + 1] for f, column in self.nodes.items()}
+        out = self.nodes
+
+        out["total"][i] = a["total"] + b["total"]
+
+        through = a["total"] + b["prefix"]
+        take = through > a["prefix"]
+        out["prefix"][i] = np.where(take, through, a["prefix"])
+        out["prefix_end"][i] = np.where(take, b["prefix_end"], a["prefix_end"])
+
+        through = b["total"] + a["suffix"]
+        take = through > b["suffix"]
+        out["suffix"][i] = np.where(take, through, b["suffix"])
+        out["suffix_start"][i] = np.where(take, a["suffix_start"], b["suffix_start"])
+
+        # left, then across the middle, then right, breaking ties the same way combine does;
+        # anything on the left ends before the other two, so it wins its ties outright
+        best, start, end = a["best"], a["best_start"], a["best_end"]
+        cross = a["suffix"] + b["prefix"]
+        take = cross > best
+        best, start, end = np.where(take, cross, best), np.where(take, a["suffix_start"], start), np.where(take, b["prefix_end"], end)
+        take = (b["best"] > best) | ((b["best"] == best) & ((b["best_end"] < end) | ((b["best_end"] == end) & (b["best_start"] > start))))
+        out["best"][i] = np.where(take, b["best"], best)
+        out["best_start"][i] = np.where(take, b["best_start"], start)
+        out["best_end"][i] = np.where(take, b["best_end"], end)
+
+    def __summary__(self, i):
+        return Summary(*(self.nodes[f][i].item() for f in self.FIELDS))
+
+    def update(self, index, value):
+        """ Sets scores[index] to value and fixes every segment containing it in O(log n). """
+        if not 0 <= index < self.n:
+            raise IndexError("update index out of bounds")
+
+        i = index + self.n
+        for f in ("total", "prefix", "suffix", "best"): self.nodes[f][i] = value
+
+        i //= 2
+        while i >= 1:
+            for f, v in zip(self.FIELDS, combine(self.__summary__(2 * i), self.__summary__(2 * i + 1))):
+                self.nodes[f][i] = v
+            i //= 2
+
+    def query(self, start, end):
+        """
+        Returns the (start, end, sum) of the best subarray within scores[start..end], taking an
+        inclusive end like brange and returning an exclusive one, in O(log n).
+        """
+        if not 0 <= start <= end < self.n:
+            raise IndexError("query range out of bounds")
+
+        # Gather whole segments from both edges towards the middle, keeping their order
+        left = right = None
+        lo, hi = start + self.n, end + self.n + 1
+
+        while lo < hi:
+            if lo & 1:
+                node = self.__summary__(lo)
+                left = node if left is None else combine(left, node)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                node = self.__summary__(hi)
+                right = node if right is None else combine(node, right)
+            lo //= 2
+            hi //= 2
+
+        result = right if left is None else left if right is None else combine(left, right)
+        return result.best_start, result.best_end, result.best
+
+
 ##
 ## TESTING
 ##
@@ -80,6 +389,100 @@ def test_brange():
     assert meal[1] == 6
 
 
+def test_kadane():
+    """ Checks Kadane's method against the known ranges and against brange. """
+    assert kadane([2, 10, 3, -1, 7]) == (0, 5, 21)
+    assert kadane([2, -9, 4, 2, 5, 3]) == (2, 6, 14)
+    assert kadane([-3, -1, -2]) == (1, 2, -1)
+
+    rng = np.random.default_rng(4)
+    rows = rng.integers(-10, 10, size=(50, 40))
+    starts, ends, sums = kadane_rows(rows)
+
+    for row, start, end, total in zip(rows, starts, ends, sums):
+        assert total == brange(row, 0, len(row) - 1)[2]
+        assert total == row[start:end].sum()
+
+    floats = rng.standard_normal((5, 30))
+    for row, total in zip(floats, kadane_rows(floats)[2]):
+        assert np.isclose(total, brange(row, 0, len(row) - 1)[2])
+
+
+def test_stream_max_subarray(tmp_path):
+    """ Checks that streaming in chunks of any size gives the same answer as kadane on the whole array. """
+    rng = np.random.default_rng(8)
+    scores = rng.integers(-10, 10, size=1000)
+
+    for size in (1, 7, 64, 1000, 5000):
+        result = stream_max_subarray(scores, chunk_size=size)
+        assert result == kadane(scores) and isinstance(result[2], int)
+
+    # an all-negative stream, read from a raw file and from a generator of uneven chunks
+    path = tmp_path / "scores.bin"
+    negative = -rng.random(100) - 1
+    negative.tofile(path)
+    assert stream_max_subarray(path, chunk_size=9) == kadane(negative)
+    assert stream_max_subarray(np.array_split(negative, [1, 2, 50])) == kadane(negative)
+
+
+def test_parallel_max_subarray():
+    """ Checks that combined shard summaries give the same best sum as brange for any sharding. """
+    rng = np.random.default_rng(9)
+
+    for trial in range(20):
+        scores = rng.integers(-10, 10, size=rng.integers(1, 200))
+        expected = brange(scores, 0, len(scores) - 1)[2]
+
+        whole = summarize(scores)
+
+        # the indices, not just the sum, must be the same however the scores are sharded
+        for shards in (1, 2, 3, 5, 8, 64):
+            start, end, best = parallel_max_subarray(scores, workers=4, shards=shards)
+            assert best == expected == scores[start:end].sum()
+            assert (start, end) == (whole.best_start, whole.best_end)
+
+    # ties go to the shortest suffix, whichever side it was found on
+    assert summarize([0, 0, 1]) == combine(summarize([0]), summarize([0, 1], 1))
+
+    # combining must not depend on the grouping
+    scores = rng.integers(-10, 10, size=100)
+    expected = brange(scores, 0, len(scores) - 1)[2]
+    parts = [summarize(part, offset) for part, offset in zip(np.split(scores, [5, 9, 30]), [0, 5, 9, 30])]
+    assert combine(combine(parts[0], parts[1]), combine(parts[2], parts[3])) == reduce(combine, parts)
+    assert parallel_max_subarray(scores, workers=2, shards=3, processes=True)[2] == expected
+
+
+def test_segment_tree():
+    """ Checks range queries after random point updates against brange on the same slice. """
+    rng = np.random.default_rng(11)
+
+    for n in (1, 2, 5, 13, 64, 100):
+        scores = rng.integers(-10, 10, size=n)
+        tree = SegmentTree(scores)
+
+        for step in range(60):
+            if rng.random() < 0.3:
+                i, v = int(rng.integers(n)), int(rng.integers(-10, 10))
+                scores[i] = v
+                tree.update(i, v)
+
+            start = int(rng.integers(n))
+            end = int(rng.integers(start, n))
+            lo, hi, best = tree.query(start, end)
+            assert best == brange(scores, start, end)[2]
+            assert start <= lo < hi <= end + 1 and scores[lo:hi].sum() == best
+
+            expected = summarize(scores[start:end + 1], start)
+            assert (lo, hi) == (expected.best_start, expected.best_end)
+
+    # indices outside the leaves would overwrite internal nodes, so they're refused
+    tree = SegmentTree([1, -5, 3, 4, -2, 6, -1, 2])
+    for index in (-1, 8):
+        with pytest.raises(IndexError): tree.update(index, 100)
+    with pytest.raises(IndexError): tree.query(3, 8)
+    assert tree.query(0, 7) == (2, 8, 12)
+
+
 ##
 ## EXPERIMENTATION
 ##
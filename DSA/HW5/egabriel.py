@@ -3,46 +3,129 @@ A minimum heap implementation with <= nlog(n) function times.
 
 @author: Elias Gabriel
 """
+from array import array
+from itertools import islice
+from operator import itemgetter
+import heapq
+import pickle
+import random
+import time
 import pytest
 from hypothesis import given
 import hypothesis.strategies as st
 
 class Heap:
-	def __init__(self, oglist=None, inplace=True):
+	def __init__(self, oglist=None, inplace=True, d=2, typecode=None):
 		"""
 		Initializes a heap from a list of arbitrary length, building it using
 		Floyd's algorithm from the bottom leaves to the root in O(n) time. The
 		heap uses a the provided list as its internal storage and simply wraps
 		it in-place.
+
+		Each node has `d` children rather than two, which makes the heap
+		shallower at the cost of more comparisons per level. Given an array
+		typecode (like 'q' or 'd'), numeric keys are stored in a compact array
+		instead of a list, which only wraps the original if it's an array of
+		that type.
 		"""
-		# if we don't want to reference the oglist, then copy it instead
-		self.internal = (oglist if inplace or not oglist else oglist.copy()) or []
+		if d < 2:
+			raise ValueError("a heap needs at least two children per node")
 
-		if len(self.internal) > 0:	
-			for i in range(len(self.internal) - 1, -1, -1):
-				self.heapify(i)
+		self.d = d
+		self.typecode = typecode
+
+		if typecode is not None:
+			wrap = inplace and isinstance(oglist, array) and oglist.typecode == typecode
+			self.internal = oglist if wrap else array(typecode, oglist or ())
+		else:
+			# if we don't want to reference the oglist, then copy it instead
+			self.internal = (oglist if inplace or not oglist else oglist.copy()) or []
+
+		self.__build__()
+
+	def __build__(self):
+		"""
+		Restores the heap property everywhere using Floyd's algorithm in O(n).
+		Only nodes with children need fixing, which starts at the last leaf's
+		parent.
+		"""
+		for i in range((len(self.internal) - 2) // self.d, -1, -1):
+			self.heapify(i)
 		
-	def heapify(self, i):
+	def heapify(self, i, n=None):
+		"""
+		Fixes the heap-ordering property below i by sifting its element down.
+		Rather than swapping at every level, the element is lifted out, leaving
+		a "hole" that smaller children move up into until the element fits.
+		Only the first n elements count as the heap, if given.
+		"""
+		A = self.internal
+		d = self.d
+		n = len(A) if n is None else n
+		item = A[i]
+		child = d * i + 1
+
+		while child < n:
+			# find the smallest of this node's (up to) d children, which for a
+			# binary heap is a single comparison that's worth not looping for
+			if d == 2:
+				smallest, value = child, A[child]
+				if child + 1 < n and A[child + 1] < value:
+					smallest, value = child + 1, A[child + 1]
+			elif d == 4 and child + 3 < n:
+				# a full set of four children is compared in pairs, and then the
+				# two winners, which keeps the earliest smallest like the loop
+				a, b, c, e = A[child], A[child + 1], A[child + 2], A[child + 3]
+				if b < a:
+					smallest, value = child + 1, b
+				else:
+					smallest, value = child, a
+				if e < c:
+					other, v = child + 3, e
+				else:
+					other, v = child + 2, c
+				if v < value:
+					smallest, value = other, v
+			else:
+				last = child + d
+				if last > n:
+					last = n
+
+				smallest, value = child, A[child]
+				for c in range(child + 1, last):
+					v = A[c]
+					if v < value:
+						smallest, value = c, v
+
+			# if even the smallest child isn't smaller, the element goes here
+			if not value < item:
+				break
+
+			A[i] = value
+			i = smallest
+			child = d * i + 1
+
+		A[i] = item
+
+	def __sift_up__(self, k):
 		"""
-		Recursivly fixes the heap-ordering property by comparing left and right
-		children to their parents and swapping where necessary.
+		Moves the element at k up past any larger parents, shifting them down
+		into the hole it leaves rather than swapping.
 		"""
-		# get left and right child elements
-		left = (2 * i) + 1
-		right = left + 1
-		smallest = i
 		A = self.internal
+		d = self.d
+		item = A[k]
+
+		while k > 0:
+			parent = (k - 1) // d
 
-		# get the smallest child if it exists
-		if left < len(A) and A[left] < A[i]:
-			smallest = left
-		if right < len(A) and A[right] < A[smallest]:
-			smallest = right
+			if item < A[parent]:
+				A[k] = A[parent]
+				k = parent
+			else:
+				break
 
-		# if a child is smaller, swap them and run this whole thing again
-		if smallest != i:
-			A[i], A[smallest] = A[smallest], A[i]
-			self.heapify(smallest)
+		A[k] = item
 
 	def __len__(self):
 		"""
@@ -56,40 +139,159 @@ class Heap:
 		heap properties. Insertion happens in log(n) time.
 		"""
 		self.internal.append(value)
-		# the current index is the last element in the array (the bottom-most right)
-		k = len(self) - 1
+		# the new element starts at the bottom-most right and moves up from there
+		self.__sift_up__(len(self) - 1)
 
-		# while the current index isn't the root
-		while k > 0:
-			# get the parent element
-			parent = (k - 1) // 2
+	def __settle__(self, start):
+		"""
+		Fixes the heap after elements were appended from index `start` on.
+		Sifting each one up costs O(k log n) for k new elements and rebuilding
+		costs O(n + k), so a large enough batch is cheaper to rebuild.
+		"""
+		n = len(self.internal)
+		k = n - start
 
-			# if the node at k is less than it's parent
-			if self.internal[k] < self.internal[parent]:
-				# swap the elements and set the new current
-				self.internal[k], self.internal[parent] = self.internal[parent], self.internal[k]
-				k = parent
-			else:
-				# validation was successful, so we know we're done
-				return None
+		if k * n.bit_length() > n:
+			self.__build__()
+		else:
+			for i in range(start, n):
+				self.__sift_up__(i)
+
+	def insert_many(self, values):
+		"""
+		Inserts every value from an iterable, either sifting each one up or
+		rebuilding the whole heap, whichever is cheaper for the batch.
+		"""
+		start = len(self)
+		self.internal.extend(values)
+		self.__settle__(start)
+
+	def merge(self, other):
+		"""
+		Inserts every element of another heap into this one, leaving the other
+		heap as it was.
+		"""
+		self.insert_many(other.internal)
+
+	def pushpop(self, value):
+		"""
+		Inserts a value and then removes and returns the minimum, in a single
+		sift. If the value is no larger than the minimum, the heap is untouched.
+		"""
+		A = self.internal
+
+		if len(A) > 0 and A[0] < value:
+			value, A[0] = A[0], value
+			self.heapify(0)
+
+		return value
+
+	def replace(self, value):
+		"""
+		Removes and returns the minimum and then inserts a value, in a single
+		sift. This returns None after just inserting if the heap was empty.
+		"""
+		A = self.internal
+
+		if len(A) == 0:
+			self.insert(value)
+			return None
+
+		m, A[0] = A[0], value
+		self.heapify(0)
+		return m
+
+	def __entry__(self, i):
+		""" Returns the element at index i as the heap's methods report it. """
+		return self.internal[i]
+
+	def nsmallest(self, k):
+		"""
+		Returns the k smallest elements in increasing order without changing
+		the heap, in O(k log k) time.
+		"""
+		return list(islice(self.iter_sorted(), max(k, 0)))
+
+	def iter_sorted(self, inplace=False):
+		"""
+		Lazily yields the elements in increasing order, so only as many as are
+		used get sorted. Unless it's inplace, which drains the heap as it goes,
+		the heap is left as it was: a node can only be next once its parent
+		has been yielded, so a small heap of candidates (starting with the
+		root) is searched instead of the whole heap, taking O(log k) time for
+		the kth element. The heap shouldn't change while this is running.
+		"""
+		if inplace:
+			while len(self) > 0:
+				yield self.delete_min()
+			return
+
+		A = self.internal
+		d = self.d
+
+		if len(A) == 0:
+			return
+
+		# candidates are (element, index) so that equal elements break ties by index
+		frontier = Heap([(A[0], 0)])
+
+		while len(frontier) > 0:
+			_, i = frontier.delete_min()
+			yield self.__entry__(i)
+
+			child = d * i + 1
+			for c in range(child, min(child + d, len(A))):
+				frontier.insert((A[c], c))
+
+	def heapsort(self, reverse=False):
+		"""
+		Sorts the heap's own storage in place and returns it, which is an
+		array if the heap has a typecode, leaving the heap empty. The minimum is repeatedly swapped to the end of a shrinking heap,
+		which sorts it into decreasing order without allocating another list;
+		increasing order then only needs it reversed.
+		"""
+		A = self.internal
+
+		for end in range(len(A) - 1, 0, -1):
+			A[0], A[end] = A[end], A[0]
+			self.heapify(0, end)
+
+		if not reverse:
+			A.reverse()
+
+		# the sorted storage belongs to the caller now, so start over empty
+		self.internal = A[:0]
+		return A
 
 	def delete_min(self):
 		"""
 		Removes the minimum value, or root, from the heap and returns it. The
 		heap properties are maintained in log(n) time.
 		"""
-		# only heapify if we need to (more than 1 element)
-		if len(self) > 1:
-			# store the current minimum and pop the last element and store it as the root
-			m, self.internal[0] = self.internal[0], self.internal.pop()
-			# reheapify at the root (which will always cascade to the right)
+		# if we don't have an element, we don't have a minimum
+		if len(self) == 0:
+			return None
+
+		last = self.internal.pop()
+
+		# only heapify if there's anything left besides the element we popped
+		if len(self) > 0:
+			# store the current minimum and move the last element to the root
+			m, self.internal[0] = self.internal[0], last
 			self.heapify(0)
 			return m
-		elif len(self) == 1:
-			# if there's just a one element, just pop it
-			return self.internal.pop()
 
-		return None
+		return last
+
+	def copy(self):
+		"""
+		Returns an independent heap with the same elements and layout. Since
+		the elements are already heap-ordered, nothing needs to be sifted.
+		"""
+		h = type(self).__new__(type(self))
+		h.__dict__.update(self.__dict__)
+		h.internal = self.internal[:]
+		return h
 
 	def min(self):
 		"""
@@ -99,25 +301,411 @@ class Heap:
 		# if we don't have an element, we don't have a minimum
 		return self.internal[0] if len(self) > 0 else None
 
-	def to_sorted(self, reverse=False, inplace=True):
+	def to_sorted(self, reverse=False, inplace=True, k=None):
 		"""
 		Returns a sorted list, either in decreasing or increasing order, of
-		all the elements in the heap.
+		all the elements in the heap, or only the k smallest of them. Unless
+		it's inplace, the heap is left as it was. Sorting everything is a
+		heapsort, and in place it sorts and returns the heap's own storage
+		(or a list of it, for a heap stored in an array).
 		"""
-		if len(self) > 0:
-			slist = [None] * len(self)
-			length = len(self)
+		count = len(self) if k is None else max(0, min(k, len(self)))
+
+		# everything is a heapsort, of a copy if the heap has to stay as it was
+		if count == len(self):
+			slist = (self if inplace else self.copy()).heapsort(reverse)
+			# array storage is sorted in place too, but handed back as a list
+			return slist.tolist() if isinstance(slist, array) else slist
+
+		# a few elements are cheaper to find than copying the heap to drain it
+		if not inplace and 16 * count < len(self):
+			slist = self.nsmallest(count)
+		else:
 			# if we don't want to modify the heap, copy it first
-			h = self if inplace else Heap(self.internal)
+			h = self if inplace else self.copy()
+			slist = list(islice(h.iter_sorted(inplace=True), count))
 
-			# iteratively remove the minimum element and add it to a list
-			for n in range(length):
-				i = length - 1 - n if reverse else n
-				slist[i] = h.delete_min()
+		if reverse:
+			slist.reverse()
 
-			return slist
-		
-		return []
+		return slist
+
+
+class IndexedHeap(Heap):
+	"""
+	An addressable heap of (handle, key) entries ordered by key, where each
+	handle (any hashable, like a graph vertex) appears at most once. A map
+	from handles to their positions lets entries be found, re-keyed, or
+	removed in O(log n), so a heap like Dijkstra's frontier can update keys
+	in place instead of piling up stale duplicates.
+	"""
+	def __init__(self, entries=None, d=2, typecode=None):
+		"""
+		Builds the heap from a mapping or iterable of (handle, key) pairs in
+		O(n). Keys live in `internal`, so they can use array storage, and
+		handles are kept alongside them in `handles`.
+		"""
+		entries = list(entries.items() if isinstance(entries, dict) else entries or ())
+		self.handles = [handle for handle, _ in entries]
+		self.position = {handle: i for i, handle in enumerate(self.handles)}
+
+		if len(self.position) != len(self.handles):
+			raise ValueError("handles must be unique")
+
+		super().__init__([key for _, key in entries], d=d, typecode=typecode)
+
+	def heapify(self, i, n=None):
+		"""
+		Sifts the entry at i down like Heap.heapify, moving its handle along
+		with its key and keeping every moved handle's position up to date.
+		"""
+		A = self.internal
+		H = self.handles
+		P = self.position
+		d = self.d
+		n = len(A) if n is None else n
+		item, handle = A[i], H[i]
+		child = d * i + 1
+
+		while child < n:
+			last = child + d
+			if last > n:
+				last = n
+
+			smallest, value = child, A[child]
+			for c in range(child + 1, last):
+				if A[c] < value:
+					smallest, value = c, A[c]
+
+			if not value < item:
+				break
+
+			A[i] = value
+			H[i] = H[smallest]
+			P[H[i]] = i
+			i = smallest
+			child = d * i + 1
+
+		A[i], H[i] = item, handle
+		P[handle] = i
+
+	def __sift_up__(self, k):
+		""" Sifts the entry at k up like Heap.__sift_up__, moving its handle too. """
+		A = self.internal
+		H = self.handles
+		P = self.position
+		d = self.d
+		item, handle = A[k], H[k]
+
+		while k > 0:
+			parent = (k - 1) // d
+
+			if item < A[parent]:
+				A[k] = A[parent]
+				H[k] = H[parent]
+				P[H[k]] = k
+				k = parent
+			else:
+				break
+
+		A[k], H[k] = item, handle
+		P[handle] = k
+
+	def __contains__(self, handle):
+		return handle in self.position
+
+	def __getitem__(self, handle):
+		"""
+		Returns the current key of a handle, raising a KeyError if it isn't in
+		the heap.
+		"""
+		return self.internal[self.position[handle]]
+
+	def contains(self, handle):
+		"""
+		Returns whether the handle is in the heap in O(1).
+		"""
+		return handle in self.position
+
+	def copy(self):
+		h = super().copy()
+		h.handles = self.handles[:]
+		h.position = self.position.copy()
+		return h
+
+	def insert(self, handle, key):
+		"""
+		Adds a handle with the given key in log(n) time. Handles must be unique,
+		so use decrease_key or increase_key to change one that's already here.
+		"""
+		if handle in self.position:
+			raise KeyError("handle {!r} is already in the heap".format(handle))
+
+		self.internal.append(key)
+		self.handles.append(handle)
+		self.__sift_up__(len(self) - 1)
+
+	def __take__(self, i):
+		"""
+		Removes the entry at position i by moving the last entry into its place
+		and sifting that whichever way it needs to go. Returns the removed pair.
+		"""
+		A = self.internal
+		key, handle = A[i], self.handles[i]
+		last, last_handle = A.pop(), self.handles.pop()
+		del self.position[handle]
+
+		if i < len(A):
+			A[i], self.handles[i] = last, last_handle
+			self.position[last_handle] = i
+
+			if i > 0 and last < A[(i - 1) // self.d]:
+				self.__sift_up__(i)
+			else:
+				self.heapify(i)
+
+		return handle, key
+
+	def insert_many(self, entries):
+		"""
+		Adds every (handle, key) pair from a mapping or iterable, sifting or
+		rebuilding like Heap.insert_many. None of the handles can be in the
+		heap already.
+		"""
+		entries = list(entries.items() if isinstance(entries, dict) else entries)
+		start = len(self)
+
+		if len({handle for handle, _ in entries}) != len(entries) or any(handle in self.position for handle, _ in entries):
+			raise KeyError("handles must be unique")
+
+		for i, (handle, key) in enumerate(entries, start):
+			self.internal.append(key)
+			self.handles.append(handle)
+			self.position[handle] = i
+
+		self.__settle__(start)
+
+	def merge(self, other):
+		"""
+		Adds every entry of another indexed heap, whose handles can't already
+		be in this one.
+		"""
+		self.insert_many(zip(other.handles, other.internal))
+
+	def pushpop(self, handle, key):
+		"""
+		Adds a handle with the given key and then removes and returns the
+		smallest (handle, key) pair, in a single sift.
+		"""
+		if handle in self.position:
+			raise KeyError("handle {!r} is already in the heap".format(handle))
+
+		if len(self) > 0 and self.internal[0] < key:
+			return self.replace(handle, key)
+
+		return handle, key
+
+	def replace(self, handle, key):
+		"""
+		Removes and returns the smallest (handle, key) pair and then adds a
+		handle with the given key, in a single sift. This returns None after
+		just inserting if the heap was empty.
+		"""
+		if len(self) == 0:
+			self.insert(handle, key)
+			return None
+
+		if self.position.get(handle, 0) != 0:
+			raise KeyError("handle {!r} is already in the heap".format(handle))
+
+		m = self.min()
+		del self.position[m[0]]
+		self.internal[0], self.handles[0] = key, handle
+		self.position[handle] = 0
+		self.heapify(0)
+		return m
+
+	def __entry__(self, i):
+		return self.handles[i], self.internal[i]
+
+	def heapsort(self, reverse=False):
+		"""
+		Returns every (handle, key) pair sorted by key, leaving the heap empty.
+		The pairs have to be built anyway, so this just drains the heap.
+		"""
+		slist = list(self.iter_sorted(inplace=True))
+
+		if reverse:
+			slist.reverse()
+
+		return slist
+
+	def delete_min(self):
+		"""
+		Removes and returns the (handle, key) pair with the smallest key, or
+		None if the heap is empty, in log(n) time.
+		"""
+		return self.__take__(0) if len(self) > 0 else None
+
+	def min(self):
+		"""
+		Returns the (handle, key) pair with the smallest key without removing
+		it, or None if the heap is empty.
+		"""
+		return (self.handles[0], self.internal[0]) if len(self) > 0 else None
+
+	def remove(self, handle):
+		"""
+		Removes a handle from anywhere in the heap in log(n) time and returns
+		its key, raising a KeyError if it isn't in the heap.
+		"""
+		return self.__take__(self.position[handle])[1]
+
+	def decrease_key(self, handle, key):
+		"""
+		Lowers the key of a handle in log(n) time. Raises a ValueError if the
+		new key is larger, since the entry would need to sift the other way.
+		"""
+		i = self.position[handle]
+
+		if self.internal[i] < key:
+			raise ValueError("new key is larger than the current key")
+
+		self.internal[i] = key
+		self.__sift_up__(i)
+
+	def increase_key(self, handle, key):
+		"""
+		Raises the key of a handle in log(n) time. Raises a ValueError if the
+		new key is smaller, since the entry would need to sift the other way.
+		"""
+		i = self.position[handle]
+
+		if key < self.internal[i]:
+			raise ValueError("new key is smaller than the current key")
+
+		self.internal[i] = key
+		self.heapify(i)
+
+
+class Reversed:
+	"""
+	Wraps a value so that it compares in the opposite order, which lets a
+	min-heap keep its largest values at the root.
+	"""
+	__slots__ = ('value',)
+
+	def __init__(self, value):
+		self.value = value
+
+	def __lt__(self, other):
+		return other.value < self.value
+
+	def __eq__(self, other):
+		return self.value == other.value
+
+
+class BoundedHeap:
+	"""
+	Keeps the k smallest (or largest) items seen in a stream using O(k)
+	memory. Items are ranked by a key function and kept whole, so records
+	carry their own payloads. The kept items sit in a heap with the worst
+	one at the root, which makes that item's key the threshold a new item
+	has to beat; anything that doesn't is rejected in O(1), and anything
+	that does replaces the root in log(k) time.
+	"""
+	def __init__(self, k, key=None, largest=False, d=2):
+		"""
+		Makes an empty heap keeping k items. Items with equal keys are kept
+		first come, first served. Without a key, items are their own keys.
+		To send the heap between processes, the key has to be picklable too,
+		like a module-level function or operator.itemgetter.
+		"""
+		if k < 0:
+			raise ValueError("k can't be negative")
+
+		self.k = k
+		self.key = key
+		self.largest = largest
+		self.heap = Heap(d=d)
+		self.threshold = None
+		self.seen = 0
+
+	def __len__(self):
+		return len(self.heap)
+
+	def push(self, item):
+		"""
+		Offers an item to the heap and returns whether it was kept.
+		"""
+		key = self.key(item) if self.key else item
+		self.seen += 1
+
+		if len(self.heap) == self.k:
+			# reject in O(1) anything no better than the worst kept item
+			if self.k == 0 or not (self.threshold < key if self.largest else key < self.threshold):
+				return False
+
+			# entries are (rank, -arrival, key, item), so later arrivals are worse on ties
+			self.heap.replace((key if self.largest else Reversed(key), -self.seen, key, item))
+		else:
+			self.heap.insert((key if self.largest else Reversed(key), -self.seen, key, item))
+
+		self.threshold = self.heap.min()[2]
+		return True
+
+	def push_many(self, items):
+		"""
+		Offers every item from an iterable and returns how many were kept.
+		"""
+		return sum(self.push(item) for item in items)
+
+	def to_sorted(self):
+		"""
+		Returns the kept items from best to worst, without changing the heap.
+		"""
+		return [entry[3] for entry in self.heap.to_sorted(reverse=True, inplace=False)]
+
+	def merge(self, *others):
+		"""
+		Offers the kept items of other bounded heaps to this one, so that the
+		top k of several shards can be combined into the top k of them all.
+		The other heaps should rank items the same way.
+		"""
+		for other in others:
+			self.push_many(other.to_sorted())
+
+
+def merge_sorted(*runs, key=None, reverse=False):
+	"""
+	Lazily merges any number of sorted iterables into one sorted stream, like
+	the merge step of an external sort. The heap holds one entry per run, so
+	each element costs a single log(k) sift for k runs no matter how long the
+	runs are. Equal elements come out in the order of their runs.
+	"""
+	key = key or (lambda item: item)
+	rank = Reversed if reverse else (lambda value: value)
+	entries = []
+
+	# entries are (rank, run, item, rest), and runs are unique so items aren't compared
+	for n, run in enumerate(runs):
+		rest = iter(run)
+		for item in rest:
+			entries.append((rank(key(item)), n, item, rest))
+			break
+
+	h = Heap(entries)
+
+	while len(h) > 0:
+		_, n, item, rest = h.min()
+		yield item
+
+		# advance the run that was just used, replacing its entry in one sift
+		for following in rest:
+			h.replace((rank(key(following)), n, following, rest))
+			break
+		else:
+			h.delete_min()
 
 
 ##
@@ -176,3 +764,199 @@ def test_heapsort(l):
 	# compare the reversed sorted list and heap
 	lsorted2 = sorted(l, reverse=True)
 	assert lsorted2 == h2.to_sorted(reverse=True)
+
+@pytest.mark.parametrize("d", [2, 4, 8])
+@given(st.lists(st.integers(min_value=-2**63, max_value=2**63 - 1)))
+def test_dary_heap(d, l):
+	for typecode in (None, 'q'):
+		h = Heap(l, inplace=False, d=d, typecode=typecode)
+		assert len(h) == len(l)
+		if len(l): assert h.min() == min(l)
+
+		# the heap property holds between every node and its parent
+		A = h.internal
+		assert all(A[(i - 1) // d] <= A[i] for i in range(1, len(A)))
+
+		# a mix of inserts and deletes still comes out in order
+		for i in l: h.insert(i)
+		assert [h.delete_min() for _ in range(len(h))] == sorted(l + l)
+		assert h.delete_min() is None
+
+@given(st.dictionaries(st.integers(0, 50), st.integers()), st.lists(st.tuples(st.integers(0, 50), st.integers())))
+def test_indexed_heap(entries, updates):
+	h = IndexedHeap(entries, d=3)
+	live = dict(entries)
+
+	# re-key or remove handles, mirroring every change in a plain dictionary
+	for handle, key in updates:
+		if handle not in h:
+			h.insert(handle, key)
+		elif key % 3 == 0:
+			assert h.remove(handle) == live.pop(handle)
+			continue
+		elif key < h[handle]:
+			h.decrease_key(handle, key)
+		else:
+			h.increase_key(handle, key)
+
+		live[handle] = key
+
+	assert len(h) == len(live) and all(h.contains(k) for k in live)
+	assert all(h.position[handle] == i for i, handle in enumerate(h.handles))
+
+	drained = [h.delete_min() for _ in range(len(h))]
+	assert sorted(live.values()) == [key for _, key in drained]
+	assert dict(drained) == live and h.min() is None
+
+def test_indexed_heap_errors():
+	h = IndexedHeap({'a': 3, 'b': 5})
+	with pytest.raises(KeyError): h.insert('a', 1)
+	with pytest.raises(ValueError): h.decrease_key('a', 4)
+	with pytest.raises(ValueError): h.increase_key('b', 1)
+	with pytest.raises(KeyError): h.remove('c')
+	with pytest.raises(ValueError): IndexedHeap([('a', 1), ('a', 2)])
+
+@given(st.lists(st.integers()), st.lists(st.integers()), st.integers(-1, 20))
+def test_heap_batches(l, batch, k):
+	h = Heap(l, inplace=False, d=4)
+	h.insert_many(batch)
+	h.merge(Heap(batch, inplace=False))
+	everything = sorted(l + batch + batch)
+
+	# nsmallest and a partial to_sorted peek without draining the heap
+	assert h.nsmallest(k) == everything[:max(k, 0)]
+	assert h.to_sorted(reverse=True, inplace=False, k=k) == everything[:max(k, 0)][::-1]
+	assert h.to_sorted(inplace=False) == everything
+	assert h.to_sorted(reverse=True, inplace=False) == everything[::-1]
+	assert h.nsmallest(len(h)) == everything
+
+	# pushpop returns the smaller of the value and the minimum, replace the old minimum
+	assert h.pushpop(0) == min(everything + [0])
+	expected = sorted(everything + [0])[1:]
+	if expected:
+		assert h.replace(7) == expected[0]
+		expected = sorted(expected[1:] + [7])
+	assert h.to_sorted() == expected
+
+@given(st.dictionaries(st.integers(0, 30), st.integers()), st.dictionaries(st.integers(31, 60), st.integers()))
+def test_indexed_heap_batches(a, b):
+	h = IndexedHeap(a)
+	h.merge(IndexedHeap(b))
+	live = {**a, **b}
+
+	assert [key for _, key in h.nsmallest(5)] == sorted(live.values())[:5]
+	assert h.pushpop(-1, min(live.values(), default=0) - 1) == (-1, min(live.values(), default=0) - 1)
+
+	if live:
+		handle, key = h.replace(99, 0)
+		assert key == min(live.values()) and live.pop(handle) == key
+		live[99] = 0
+
+	assert all(h.position[handle] == i for i, handle in enumerate(h.handles))
+	drained = h.to_sorted()
+	assert dict(drained) == live and [key for _, key in drained] == sorted(live.values())
+
+@pytest.mark.parametrize("largest", [False, True])
+@given(st.lists(st.tuples(st.integers(-20, 20), st.text(max_size=2))), st.integers(0, 10))
+def test_bounded_heap(largest, records, k):
+	h = BoundedHeap(k, key=lambda r: r[0], largest=largest)
+	h.push_many(records)
+	assert len(h) == min(k, len(records))
+
+	# a stable sort gives the same winners, with ties kept in arrival order
+	expected = sorted(records, key=lambda r: -r[0] if largest else r[0])[:k]
+	assert h.to_sorted() == expected
+
+	# shards of the stream merge into the top k of the whole stream
+	shards = [BoundedHeap(k, key=lambda r: r[0], largest=largest) for _ in range(3)]
+	for i, shard in enumerate(shards):
+		shard.push_many(records[i::3])
+
+	merged = BoundedHeap(k, key=lambda r: r[0], largest=largest)
+	merged.merge(*shards)
+	assert [r[0] for r in merged.to_sorted()] == [r[0] for r in expected]
+
+def test_bounded_heap_pickles():
+	# shards come back from worker processes pickled, with or without a key
+	for key, stream in ((None, [5, 1, 4, 2, 3]), (itemgetter(0), [(5, 'a'), (1, 'b'), (4, 'c'), (2, 'd')])):
+		shard = BoundedHeap(2, key=key)
+		shard.push_many(stream[:3])
+		shard = pickle.loads(pickle.dumps(shard))
+
+		merged = BoundedHeap(2, key=key)
+		merged.push_many(stream[3:])
+		merged.merge(shard)
+		assert merged.to_sorted() == sorted(stream)[:2]
+		assert shard.push(stream[0]) is False
+
+@given(st.lists(st.integers(min_value=-2**63, max_value=2**63 - 1)), st.integers(0, 10))
+def test_heapsort_inplace(l, k):
+	for d, typecode in ((2, None), (4, 'q')):
+		original = list(l) if typecode is None else array(typecode, l)
+		h = Heap(original, d=d, typecode=typecode)
+
+		# the lazy form peeks without changing the heap
+		assert list(islice(h.iter_sorted(), k)) == sorted(l)[:k]
+		assert list(h.iter_sorted()) == sorted(l) and len(h) == len(l)
+
+		# to_sorted always gives back a list, even for an empty or array heap
+		copy = h.copy()
+		result = h.to_sorted()
+		assert result == sorted(l) and type(result) is list and len(h) == 0
+		if typecode is None and l: assert result is original
+
+		# while heapsort hands back the heap's own storage, sorted
+		backing = copy.internal
+		storage = copy.heapsort(reverse=True)
+		assert storage is backing and len(copy) == 0
+		assert list(storage) == sorted(l, reverse=True) and type(storage) is type(original)
+
+@given(st.lists(st.lists(st.integers())), st.booleans())
+def test_merge_sorted(runs, reverse):
+	runs = [sorted(run, key=abs, reverse=reverse) for run in runs]
+	merged = list(merge_sorted(*runs, key=abs, reverse=reverse))
+	assert merged == list(heapq.merge(*runs, key=abs, reverse=reverse))
+
+
+##
+## PERFORMANCE
+##
+
+
+def sort_benchmark(sizes=(10**3, 10**5, 10**6), k=10, runs=16):
+	"""
+	Times sorting random floats with sorted(), heapq, and this heap, both in
+	full and for just the first k elements, along with merging sorted runs,
+	and prints the seconds each took.
+	"""
+	def clock(f, *args):
+		base = time.perf_counter()
+		f(*args)
+		return time.perf_counter() - base
+
+	def heapq_sort(l):
+		heapq.heapify(l)
+		return [heapq.heappop(l) for _ in range(len(l))]
+
+	for n in sizes:
+		l = [random.random() for _ in range(n)]
+		chunks = [sorted(l[i::runs]) for i in range(runs)]
+
+		print("n =", n)
+		print(" --> full sort:   sorted {:.4f}s, heapq {:.4f}s, heapsort {:.4f}s, d=4 {:.4f}s".format(
+			clock(sorted, l),
+			clock(heapq_sort, list(l)),
+			clock(lambda: Heap(list(l)).to_sorted()),
+			clock(lambda: Heap(list(l), d=4).to_sorted())))
+		print(" --> first {}:     sorted {:.4f}s, heapq {:.4f}s, iter_sorted {:.4f}s".format(k,
+			clock(lambda: sorted(l)[:k]),
+			clock(heapq.nsmallest, k, l),
+			clock(lambda: list(islice(Heap(list(l)).iter_sorted(), k)))))
+		print(" --> {} runs:      sorted {:.4f}s, heapq {:.4f}s, merge_sorted {:.4f}s".format(runs,
+			clock(lambda: sorted(x for chunk in chunks for x in chunk)),
+			clock(lambda: list(heapq.merge(*chunks))),
+			clock(lambda: list(merge_sorted(*chunks)))))
+
+
+if __name__ == "__main__":
+	sort_benchmark()
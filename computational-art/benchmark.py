@@ -0,0 +1,239 @@
+"""
+Benchmarks the recursive art renderers across image sizes, function depths, seeds, and worker
+counts, and records the results to a JSON file so regressions can be caught between runs.
+
+@author: Elias Gabriel
+@revision: v1.0
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import queue
+import random
+import resource
+import tempfile
+import time
+import multiprocessing as mp
+import numpy as np
+import recursive_art as ra
+
+
+# Every renderer that can be benchmarked, called with (filename, x_size, y_size, workers, functions).
+# New backends only need an entry here to be picked up by the harness.
+BACKENDS = {
+    "sync": lambda filename, x, y, workers, functions: ra.generate_art_sync(filename, x, y, functions),
+    "async": lambda filename, x, y, workers, functions: ra.generate_art_async(filename, x, y, workers, functions),
+    "stream": lambda filename, x, y, workers, functions: ra.generate_art_stream(filename, x, y, workers, functions=functions)
+}
+
+# Backends that always render on a single core, and so only need to run once per worker count
+SERIAL_BACKENDS = {"sync"}
+
+
+def build_cases(backends, sizes, depths, seeds, workers):
+    """ Expands the benchmark grid into one case per combination of its axes. Serial backends ignore
+    the worker count, so they get a single case with one worker instead of one per count.
+
+    - backends: names of the backends in `BACKENDS` to run
+    - sizes: (x_size, y_size) image dimensions
+    - depths: (min_depth, max_depth) bounds for the random functions
+    - seeds: random seeds to build the functions from
+    - workers: worker counts for the parallel backends
+
+    >>> cases = build_cases(["sync", "async"], [(64, 64)], [(9, 15)], [0], [2, 4])
+    >>> [(case["backend"], case["workers"]) for case in cases]
+    [('sync', 1), ('async', 2), ('async', 4)]
+    """
+    cases = []
+
+    for backend, size, depth, seed in itertools.product(backends, sizes, depths, seeds):
+        for count in [1] if backend in SERIAL_BACKENDS else workers:
+            cases.append({
+                "backend": backend,
+                "x_size": size[0],
+                "y_size": size[1],
+                "min_depth": depth[0],
+                "max_depth": depth[1],
+                "seed": seed,
+                "workers": count
+            })
+
+    return cases
+
+
+def _run_case(case, results):
+    """ Renders one case and reports its timings. Runs in a fresh process so that the peak memory
+    it reports belongs to this case alone. """
+    random.seed(case["seed"])
+    functions = [ra.build_random_expression(case["min_depth"], case["max_depth"]) for _ in range(3)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "benchmark.png")
+        base = time.perf_counter()
+        BACKENDS[case["backend"]](filename, case["x_size"], case["y_size"], case["workers"], functions)
+        seconds = time.perf_counter() - base
+
+    # Pool workers are children of this process, so the larger of the two is the peak of the case
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    startup = ra.measure_pool_startup(case["workers"]) if case["backend"] not in SERIAL_BACKENDS else 0.0
+
+    results.put({
+        "seconds": seconds,
+        "pixels_per_second": case["x_size"] * case["y_size"] / seconds,
+        "peak_rss_kb": peak,
+        "pool_startup_seconds": startup,
+        "nodes": len(ra._schedule(ra.optimize_expressions(functions)[0])[0])
+    })
+
+
+def _collect(process, results, timeout):
+    """ Waits for the result of a case, or returns None if its process exits without one or it runs
+    out of time. """
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        try:
+            return results.get(timeout=min(1, max(0, deadline - time.perf_counter())))
+        except queue.Empty:
+            if not process.is_alive():
+                # The result may have arrived just as the process exited
+                try:
+                    return results.get(timeout=0.1)
+                except queue.Empty:
+                    return None
+
+    return None
+
+
+def run_benchmarks(cases, repeat=1, timeout=600):
+    """ Runs every case `repeat` times, each in a fresh process, and returns the cases with the
+    median time of their runs and the worst peak memory. A case whose process fails or takes longer
+    than `timeout` seconds is recorded as failed, with its exit code, and not run again.
+
+    - cases: the cases to run, as built by `build_cases`
+    - repeat: how many times to run each case
+    - timeout: how many seconds one run of a case may take
+    """
+    context = mp.get_context("spawn")
+    records = []
+
+    for case in cases:
+        runs = []
+
+        for _ in range(repeat):
+            results = context.Queue()
+            process = context.Process(target=_run_case, args=(case, results))
+            process.start()
+            run = _collect(process, results, timeout)
+
+            if process.is_alive():
+                process.terminate()
+
+            process.join()
+
+            if run is None:
+                break
+
+            runs.append(run)
+
+        if len(runs) < repeat:
+            records.append(dict(case, failed=True, exitcode=process.exitcode))
+            print("{backend:>6} {x_size}x{y_size} depth {min_depth}-{max_depth} seed {seed} workers {workers}: "
+                  "failed with exit code {exitcode}".format(**records[-1]))
+            continue
+
+        runs.sort(key=lambda run: run["seconds"])
+        record = dict(case, **runs[len(runs) // 2])
+        record["peak_rss_kb"] = max(run["peak_rss_kb"] for run in runs)
+        records.append(record)
+
+        print("{backend:>6} {x_size}x{y_size} depth {min_depth}-{max_depth} seed {seed} workers {workers}: "
+              "{pixels_per_second:,.0f} px/s, {peak_rss_kb:,} KB peak".format(**record))
+
+    return records
+
+
+def find_regressions(records, baseline, tolerance=0.1):
+    """ Compares the throughput of each case against the same case in an earlier run, and returns
+    the cases that got slower by more than the tolerance. Failed cases have no throughput to
+    compare, so they are left to the caller.
+
+    - records: the results of this run
+    - baseline: the results of an earlier run
+    - tolerance: the fraction of throughput a case may lose before it counts as a regression
+
+    >>> old = [{"backend": "sync", "x_size": 8, "y_size": 8, "min_depth": 1, "max_depth": 2,
+    ...         "seed": 0, "workers": 1, "pixels_per_second": 100.0}]
+    >>> new = [dict(old[0], pixels_per_second=95.0), dict(old[0], seed=1, pixels_per_second=1.0)]
+    >>> find_regressions(new, old)
+    []
+    >>> [r["pixels_per_second"] for r in find_regressions(new, old, tolerance=0.01)]
+    [95.0]
+    """
+    keys = ("backend", "x_size", "y_size", "min_depth", "max_depth", "seed", "workers")
+    before = {tuple(record[k] for k in keys): record for record in baseline}
+    regressions = []
+
+    for record in records:
+        old = before.get(tuple(record[k] for k in keys))
+
+        if record.get("failed") or not old or old.get("failed"):
+            continue
+
+        if record["pixels_per_second"] < old["pixels_per_second"] * (1 - tolerance):
+            regressions.append(record)
+
+    return regressions
+
+
+def _pairs(text):
+    """ Parses "AxB" into a tuple of two integers, for sizes and depth bounds on the command line. """
+    a, b = text.lower().split("x")
+    return int(a), int(b)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the recursive art renderers.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--sizes", nargs="+", type=_pairs, default=[(64, 64), (350, 350), (1000, 1000)],
+                        help="image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--depths", nargs="+", type=_pairs, default=[(9, 15)], help="depth bounds as MINxMAX")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[4558106513883317379])
+    parser.add_argument("--workers", nargs="+", type=int, default=sorted({1, 2, mp.cpu_count()}))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="an earlier output file to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds one run of a case may take")
+    args = parser.parse_args()
+
+    records = run_benchmarks(build_cases(args.backends, args.sizes, args.depths, args.seeds, args.workers),
+                             args.repeat, args.timeout)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "machine": {
+                "host": platform.node(),
+                "cpus": mp.cpu_count(),
+                "python": platform.python_version(),
+                "numpy": np.__version__
+            },
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": records
+        }, f, indent=2)
+
+    failures = [record for record in records if record.get("failed")]
+    regressions = []
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(records, json.load(f)["results"], args.tolerance)
+
+        for record in regressions:
+            print("Regression: {backend} {x_size}x{y_size} seed {seed} workers {workers}".format(**record))
+
+    if failures or regressions:
+        raise SystemExit(1)
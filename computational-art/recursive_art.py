@@ -4,14 +4,20 @@ A set of tools for looking at art from a computer's perspective.
 @author: Elias Gabriel
 @revision: v2.0
 """
+import json
+import os
+import platform
 import random
+import struct
+import time
+import zlib
+import numpy as np
 from PIL import Image
-from numpy import pi, cos, sin, tanh, sinh, cosh, arctan, linspace
-from itertools import product
-# Use the uqfoundation/multiprocess package to support lambda pickling, since
-# the default package does not support it.
-# Required to send the result of `build_random_function()` to multiple processes.
-import multiprocess as mp
+from numpy import pi, cos, sin, tanh, sinh, cosh, arctan
+# Workers receive compiled programs (plain bytes) rather than lambdas, so the default
+# multiprocessing package is enough and nothing needs to be pickled by value.
+import multiprocessing as mp
+import multiprocessing.shared_memory
 
 
 
@@ -35,6 +41,23 @@ FUNCTIONS = [
     lambda c: tanh(c[1])
 ]
 
+# Extra functions for animations, which also read a time coordinate, accepts tuple (x, y, t)
+TIME_FUNCTIONS = [
+    lambda c: c[2],
+    lambda c: cos(pi * c[2]),
+    lambda c: sin(pi * c[2]),
+    lambda c: c[0] * c[2],
+    lambda c: (c[1] + c[2]) / 2
+]
+
+# Every function an expression node can refer to, indexed by its op. Branches pass their
+# children's values as (x, y) along with the time coordinate, if there is one.
+OPERATIONS = FUNCTIONS + TIME_FUNCTIONS
+
+# The children each operation actually reads, 0 for x and 1 for y, indexed like `OPERATIONS`
+READS = [(0, 1), (0, 1), (0,), (1,), (0,), (1,), (0,), (1,), (0,), (1,),
+         (), (), (), (0,), (1,)]
+
 
 def build_random_function(min_depth, max_depth):
     """ Builds a random function of depth at least min_depth and depth at most max_depth.
@@ -95,6 +118,346 @@ def build_random_function(min_depth, max_depth):
     return lambda c: rand_func(c)
 
 
+class Expression:
+    """ A node in a random function tree. Unlike the lambdas built by `build_random_function`,
+    an expression keeps its structure around and evaluates entire NumPy coordinate grids at once,
+    so a whole image costs one call per node rather than one call per node per pixel.
+
+    - op: the index of the node's function in `OPERATIONS`
+    - x, y: the child expressions feeding the function, or None if the node is a leaf
+
+    # Leaves apply their function directly to the input coordinates, while branches apply it to
+      the results of their children. Both work equally well on scalars and on arrays.
+    >>> Expression(0)((0.5, 0.25))
+    0.125
+    >>> Expression(1, Expression(6), Expression(0))((np.array([0.5, 1.0]), np.array([0.5, -1.0])))
+    array([0.375, 0.   ])
+    """
+    def __init__(self, op, x=None, y=None):
+        self.op = op
+        self.x = x
+        self.y = y
+
+    def __call__(self, c):
+        # Leaves read the coordinates, branches read the values of their children
+        if self.x is None:
+            return OPERATIONS[self.op](c)
+
+        return OPERATIONS[self.op]((self.x(c), self.y(c), *c[2:]))
+
+
+def build_random_expression(min_depth, max_depth, animated=False):
+    """ Builds a random expression tree of depth at least min_depth and depth at most max_depth.
+    Consumes random numbers in exactly the same order as `build_random_function`, so for the same
+    seed both builders produce the same function.
+
+    - min_depth: the minimum depth of the random function
+    - max_depth: the maximum depth of the random function
+    - animated: whether to also use `TIME_FUNCTIONS`, so the function takes (x, y, t)
+
+    # The tests mirror those of `build_random_function`, and check that the tree agrees with the
+      lambda version for the same seed.
+    >>> random.seed(4558106513883317379)
+    >>> float(build_random_expression(3, 5)((0.25, 0.75)))
+    0.4632169206037787
+    >>> random.seed(4558106513883317379)
+    >>> float(build_random_expression(-1, 9)((-1, 1)))
+    -0.8807970779778824
+    >>> random.seed(4558106513883317379)
+    >>> f = build_random_function(9, 12)
+    >>> random.seed(4558106513883317379)
+    >>> g = build_random_expression(9, 12)
+    >>> xs, ys = np.linspace(-1, 1, 7), np.linspace(1, -1, 7)
+    >>> bool(np.array_equal(g((xs, ys)), [f(c) for c in zip(xs, ys)]))
+    True
+    >>> random.seed(4558106513883317379)
+    >>> float(build_random_expression(3, 5, animated=True)((0.25, 0.75, -0.5)))
+    -0.39552669529663687
+    >>> build_random_expression(4, 3)
+    Traceback (most recent call last):
+        ...
+    Exception: The minimum depth must be less than the maxiumum!
+    """
+    if min_depth > max_depth:
+        raise Exception("The minimum depth must be less than the maxiumum!")
+
+    min_depth = max(1, min_depth)
+    max_depth = max(1, max_depth)
+
+    # Choose the function by index rather than by value, which draws the same random number
+    # as `random.choice(FUNCTIONS)` does
+    op = random.randrange(len(OPERATIONS) if animated else len(FUNCTIONS))
+
+    if max_depth > 1 and (min_depth > 1 or random.random() >= 0.5):
+        x = build_random_expression(min_depth - 1, max_depth - 1, animated)
+        y = build_random_expression(min_depth - 1, max_depth - 1, animated)
+        return Expression(op, x, y)
+
+    return Expression(op)
+
+
+# Opcode flag marking a leaf, which applies its function to the input coordinates rather
+# than to the two values on top of the stack
+LEAF = 0x80
+
+
+def compile_expression(expression):
+    """ Serializes an expression tree into a compact postfix program, one byte per node. Each byte
+    holds the index of the node's operation in `OPERATIONS` (the time functions come after the plain
+    ones), with the `LEAF` flag set on leaves. Children always come before their parent, x before y.
+
+    - expression: the expression tree to serialize
+
+    >>> compile_expression(Expression(1, Expression(6), Expression(0, Expression(2), Expression(3))))
+    b'\\x86\\x82\\x83\\x00\\x01'
+    """
+    program = bytearray()
+    # Walk the tree iteratively, emitting a node only once both of its children are emitted
+    stack = [(expression, False)]
+
+    while stack:
+        node, expanded = stack.pop()
+
+        if node.x is None:
+            program.append(LEAF | node.op)
+        elif expanded:
+            program.append(node.op)
+        else:
+            stack.extend(((node, True), (node.y, False), (node.x, False)))
+
+    return bytes(program)
+
+
+def load_expression(program):
+    """ Rebuilds the expression tree that a program was compiled from.
+
+    - program: the bytes produced by `compile_expression`
+
+    >>> random.seed(4558106513883317379)
+    >>> program = compile_expression(build_random_expression(3, 5))
+    >>> compile_expression(load_expression(program)) == program
+    True
+    """
+    stack = []
+
+    for code in program:
+        if code & LEAF:
+            stack.append(Expression(code & ~LEAF))
+        else:
+            y = stack.pop()
+            stack[-1] = Expression(code, stack[-1], y)
+
+    return stack[0]
+
+
+def evaluate_program(program, c):
+    """ Runs a compiled program as a stack machine over a pair of coordinates, which may be scalars
+    or NumPy arrays. Gives the same result as evaluating the expression it was compiled from.
+
+    - program: the bytes produced by `compile_expression`
+    - c: the (x, y) coordinates to evaluate the function at
+
+    >>> random.seed(4558106513883317379)
+    >>> float(evaluate_program(compile_expression(build_random_expression(3, 5)), (0.25, 0.75)))
+    0.4632169206037787
+    """
+    stack = []
+
+    for code in program:
+        if code & LEAF:
+            stack.append(OPERATIONS[code & ~LEAF](c))
+        else:
+            y = stack.pop()
+            stack[-1] = OPERATIONS[code]((stack[-1], y, *c[2:]))
+
+    return stack[0]
+
+
+def optimize_expressions(functions):
+    """ Merges several expression trees into one shared graph, so that identical subtrees anywhere
+    in any of the functions become a single node that is evaluated once. Children a function
+    ignores, like the y of `cos(pi * c[0])`, are dropped, and nodes that just pass one of their
+    inputs through, like `c[0]` with children, are folded away along the way. Returns the new
+    roots, in order, and how many nodes were removed.
+
+    - functions: the expression trees to optimize, usually the red, green, and blue channels
+
+    # The x projection and the average of two equal values both reduce to their x child, which
+      then matches the other copy of `cos(pi * c[0])`.
+    >>> cos_x = lambda: Expression(2)
+    >>> roots, removed = optimize_expressions([Expression(6, cos_x(), Expression(0)),
+    ...                                        Expression(1, cos_x(), cos_x())])
+    >>> removed, roots[0] is roots[1]
+    (5, True)
+
+    # `cos(pi * c[0])` ignores its y child, so two of them with different y children are the same.
+    >>> roots, removed = optimize_expressions([Expression(2, Expression(6), Expression(0)),
+    ...                                        Expression(2, Expression(6), Expression(3))])
+    >>> removed, roots[0] is roots[1], roots[0].x is roots[0].y
+    (4, True, True)
+    >>> random.seed(4558106513883317379)
+    >>> functions = [build_random_expression(9, 15) for _ in range(3)]
+    >>> optimize_expressions(functions)[1]
+    6246
+    >>> c = coordinate_grid(16, 16)
+    >>> all(bool(np.array_equal(a, f(c))) for a, f in
+    ...     zip(evaluate_expressions(optimize_expressions(functions)[0], c), functions))
+    True
+    """
+    # Canonical node for every (function, children) combination seen so far
+    table = {}
+    # Canonical node for every node of the input, by identity
+    canonical = {}
+
+    for function in functions:
+        stack = [(function, False)]
+
+        while stack:
+            node, expanded = stack.pop()
+
+            if id(node) in canonical:
+                continue
+            elif node.x is not None and not expanded:
+                # Children the function ignores are never visited, so they drop out of the graph
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed([(node.x, node.y)[i] for i in READS[node.op]]))
+                continue
+
+            if node.x is None or not READS[node.op]:
+                # Branches that ignore both children, like the time projection, are the same as leaves
+                key = (node.op,)
+            elif READS[node.op] == (0, 1):
+                x, y = canonical[id(node.x)], canonical[id(node.y)]
+
+                # The average of a value with itself is just that value
+                if node.op == 1 and x is y:
+                    canonical[id(node)] = x
+                    continue
+
+                key = (node.op, id(x), id(y))
+            else:
+                # The one child that is read stands in for both, so the ignored one is never evaluated
+                x = y = canonical[id((node.x, node.y)[READS[node.op][0]])]
+
+                # The c[0] and c[1] projections are always exactly the child they read
+                if node.op in (6, 7):
+                    canonical[id(node)] = x
+                    continue
+
+                key = (node.op, id(x))
+
+            if key not in table:
+                table[key] = Expression(node.op) if len(key) == 1 else Expression(node.op, x, y)
+
+            canonical[id(node)] = table[key]
+
+    roots = [canonical[id(function)] for function in functions]
+    return roots, sum(_tree_size(function) for function in functions) - len(_schedule(roots)[0])
+
+
+def _tree_size(expression):
+    """ Counts the nodes of an expression, as a tree. """
+    count = 0
+    stack = [expression]
+
+    while stack:
+        node = stack.pop()
+        count += 1
+
+        if node.x is not None:
+            stack.extend((node.x, node.y))
+
+    return count
+
+
+def _schedule(roots):
+    """ Orders the distinct nodes of a shared graph so that every node comes after its children,
+    and counts how many times each node's value is read by a parent or returned as a root. """
+    order = []
+    uses = {}
+    seen = set()
+    stack = [(root, False) for root in reversed(roots)]
+
+    for root in roots:
+        uses[id(root)] = uses.get(id(root), 0) + 1
+
+    while stack:
+        node, expanded = stack.pop()
+
+        if expanded:
+            order.append(node)
+        elif id(node) not in seen:
+            seen.add(id(node))
+            stack.append((node, True))
+
+            if node.x is not None:
+                for child in (node.y, node.x):
+                    uses[id(child)] = uses.get(id(child), 0) + 1
+                    stack.append((child, False))
+
+    return order, uses
+
+
+def evaluate_expressions(functions, c):
+    """ Evaluates several functions that may share nodes over the same coordinates, computing each
+    distinct node once. Values are dropped as soon as the last node that needs them is done, so
+    only the live part of the graph is held in memory.
+
+    - functions: the expressions to evaluate, usually the result of `optimize_expressions`
+    - c: the (x, y) coordinates to evaluate the functions at
+
+    >>> shared = Expression(2)
+    >>> [float(v) for v in evaluate_expressions([shared, Expression(0, shared, shared)], (0.0, 0.0))]
+    [1.0, 1.0]
+    """
+    order, uses = _schedule(functions)
+    values = {}
+
+    for node in order:
+        if node.x is None:
+            values[id(node)] = OPERATIONS[node.op](c)
+            continue
+
+        values[id(node)] = OPERATIONS[node.op]((values[id(node.x)], values[id(node.y)], *c[2:]))
+
+        # Free the children once every parent that reads them has been evaluated
+        for child in (node.x, node.y):
+            uses[id(child)] -= 1
+
+            if uses[id(child)] == 0:
+                del values[id(child)]
+
+    return [values[id(function)] for function in functions]
+
+
+def save_functions(filename, functions):
+    """ Writes the compiled programs for a set of channel functions to a file, each prefixed with
+    its length, so the same art can be re-rendered later without rebuilding it from a seed.
+
+    - filename: the file to write to
+    - functions: the expression trees for each channel
+    """
+    with open(filename, "wb") as f:
+        for function in functions:
+            program = compile_expression(function)
+            f.write(struct.pack("<I", len(program)))
+            f.write(program)
+
+
+def load_functions(filename):
+    """ Reads back the channel functions written by `save_functions` as expression trees.
+
+    - filename: the file to read from
+    """
+    functions = []
+
+    with open(filename, "rb") as f:
+        while header := f.read(4):
+            functions.append(load_expression(f.read(struct.unpack("<I", header)[0])))
+
+    return functions
+
+
 def remap_interval(val, min1, max1, min2, max2):
     """ Remap a value from one range to a new range.
 
@@ -143,97 +506,575 @@ def color_map(val):
     return int(round(remap_interval(val, -1, 1, 0, 255)))
 
 
-def generate_art(filename, x_size=350, y_size=350):
+def color_map_array(vals):
+    """ Maps an array of values between -1 and 1 to 8-bit color codes. This is the vectorized
+    counterpart of `color_map`, and rounds halves to even just like Python's `round` does.
+
+    - vals: array of values to remap, must be within the interval [-1, 1]
+
+    >>> color_map_array(np.array([-1.0, 1.0, 0.0, 0.5]))
+    array([  0, 255, 128, 191], dtype=uint8)
+    """
+    return np.rint(remap_interval(vals, -1, 1, 0, 255)).astype(np.uint8)
+
+
+def coordinate_grid(x_size, y_size, rows=None, times=None):
+    """ Returns the x and y coordinates of every pixel in an image as a sparse grid, which is a row
+    of x values and a column of y values that NumPy broadcasts against each other. The values are
+    identical to calling `remap_interval` on each pixel index. If times are given, the grid gains
+    a leading frame axis and a third coordinate holding the time of each frame.
+
+    - x_size, y_size: dimensions of the image
+    - rows: optional (start, stop) range of rows to return coordinates for, defaults to all rows
+    - times: optional sequence of time coordinates, one per frame
+
+    >>> x, y = coordinate_grid(4, 2)
+    >>> x
+    array([[-1. , -0.5,  0. ,  0.5]])
+    >>> y
+    array([[-1.],
+           [ 0.]])
+    >>> coordinate_grid(4, 4, rows=(1, 3))[1]
+    array([[-0.5],
+           [ 0. ]])
+    >>> [a.shape for a in coordinate_grid(4, 2, times=[-1, 0, 1])]
+    [(1, 1, 4), (1, 2, 1), (3, 1, 1)]
+    """
+    start, stop = rows or (0, y_size)
+    x = remap_interval(np.arange(x_size), 0, x_size, -1, 1)
+    y = remap_interval(np.arange(start, stop), 0, y_size, -1, 1)
+
+    if times is None:
+        return x[np.newaxis, :], y[:, np.newaxis]
+
+    t = np.asarray(times, dtype=float)
+    return x[np.newaxis, np.newaxis, :], y[np.newaxis, :, np.newaxis], t[:, np.newaxis, np.newaxis]
+
+
+def render_pixels(functions, x_size, y_size, rows=None, out=None):
+    """ Evaluates the red, green, and blue functions over every pixel of an image at once, and returns
+    the colors as a (rows, x_size, 3) array of bytes ready to be handed to PIL.
+
+    - functions: the red, green, and blue expressions, which may share nodes
+    - x_size, y_size: dimensions of the image
+    - rows: optional (start, stop) range of rows to render, defaults to all rows
+    - out: optional array to write the colors into instead of allocating a new one
+
+    # A function may ignore one of the coordinates, so each channel is broadcast back up to the
+      full image size.
+    >>> render_pixels([Expression(6), Expression(7), Expression(0)], 3, 2)[1]
+    array([[  0, 128, 128],
+           [ 85, 128, 128],
+           [170, 128, 128]], dtype=uint8)
+    >>> bool(np.array_equal(render_pixels([Expression(0)] * 3, 5, 4, rows=(2, 4)),
+    ...                     render_pixels([Expression(0)] * 3, 5, 4)[2:]))
+    True
+    """
+    start, stop = rows or (0, y_size)
+    c = coordinate_grid(x_size, y_size, (start, stop))
+
+    if out is None:
+        out = np.empty((stop - start, x_size, 3), dtype=np.uint8)
+
+    for channel, values in enumerate(evaluate_expressions(functions, c)):
+        out[:, :, channel] = color_map_array(np.broadcast_to(values, (stop - start, x_size)))
+
+    return out
+
+
+def render_frames(functions, x_size, y_size, times):
+    """ Evaluates animated red, green, and blue functions over a batch of frames at once, walking the
+    expressions a single time for the whole batch. Returns the colors as a (frames, y_size, x_size, 3)
+    array of bytes.
+
+    - functions: the red, green, and blue expressions, which may share nodes and read time
+    - x_size, y_size: dimensions of each frame
+    - times: sequence of time coordinates, one per frame
+
+    >>> frames = render_frames([Expression(10), Expression(6), Expression(13)], 2, 1, [-1, 0, 1])
+    >>> frames[:, 0, 0]
+    array([[  0,   0, 255],
+           [128,   0, 128],
+           [255,   0,   0]], dtype=uint8)
+    """
+    c = coordinate_grid(x_size, y_size, times=times)
+    shape = (len(times), y_size, x_size)
+    out = np.empty(shape + (3,), dtype=np.uint8)
+
+    for channel, values in enumerate(evaluate_expressions(functions, c)):
+        out[..., channel] = color_map_array(np.broadcast_to(values, shape))
+
+    return out
+
+
+def split_tiles(x_size, y_size, workers, max_pixels=2**18):
+    """ Splits an image into bands of whole rows for workers to render. There are a few bands per
+    worker so that slow bands even out, and no band is so large that its intermediate arrays blow up.
+
+    - x_size, y_size: dimensions of the image
+    - workers: the number of processes that will render the bands
+    - max_pixels: the largest number of pixels allowed in one band
+
+    >>> split_tiles(10, 10, 2)
+    [(0, 2), (2, 4), (4, 6), (6, 8), (8, 10)]
+    >>> split_tiles(1000, 10, 1, max_pixels=4000)
+    [(0, 3), (3, 6), (6, 9), (9, 10)]
+    """
+    # Aim for four bands per worker, but always at least one row per band
+    height = max(1, min(-(-y_size // (4 * workers)), max_pixels // max(1, x_size)))
+    return [(start, min(start + height, y_size)) for start in range(0, y_size, height)]
+
+
+def _png_chunk(kind, data):
+    """ Packs data into a PNG chunk, which is its length, type, data, and checksum. """
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_image_stream(filename, x_size, y_size, bands):
+    """ Writes an image to disk one band of rows at a time, so only the current band needs to be in
+    memory. Files ending in .ppm are written as raw binary PPM, and everything else as PNG, with
+    each band compressed into the file as soon as it arrives.
+
+    - filename: string filename for image (should be .png or .ppm)
+    - x_size, y_size: dimensions of the image
+    - bands: iterable of (rows, x_size, 3) byte arrays, in order from the top of the image
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "stream.png")
+    >>> pixels = render_pixels([Expression(0), Expression(2), Expression(5)], 7, 5)
+    >>> write_image_stream(path, 7, 5, [pixels[:2], pixels[2:]])
+    >>> bool(np.array_equal(np.asarray(Image.open(path)), pixels))
+    True
+    """
+    with open(filename, "wb") as f:
+        if filename.lower().endswith(".ppm"):
+            f.write(b"P6\n%d %d\n255\n" % (x_size, y_size))
+
+            for band in bands:
+                f.write(np.ascontiguousarray(band).tobytes())
+
+            return
+
+        # 8-bit RGB, no interlacing
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", x_size, y_size, 8, 2, 0, 0, 0)))
+        compressor = zlib.compressobj()
+
+        for band in bands:
+            # Every row of a PNG starts with its filter type, which is always 0 (none) here
+            rows = np.zeros((len(band), x_size * 3 + 1), dtype=np.uint8)
+            rows[:, 1:] = band.reshape(len(band), x_size * 3)
+            data = compressor.compress(rows.tobytes())
+
+            if data:
+                f.write(_png_chunk(b"IDAT", data))
+
+        f.write(_png_chunk(b"IDAT", compressor.flush()))
+        f.write(_png_chunk(b"IEND", b""))
+
+
+# State shared by every task a worker renders, set once when the worker starts
+_worker = {}
+
+
+def _init_worker(programs, x_size, y_size, name=None):
+    """ Stores the channel programs in a pool worker, and attaches it to the shared image buffer
+    if there is one. """
+    if name is not None:
+        _worker["memory"] = shm = mp.shared_memory.SharedMemory(name=name)
+        _worker["pixels"] = np.ndarray((y_size, x_size, 3), dtype=np.uint8, buffer=shm.buf)
+
+    _worker["functions"] = optimize_expressions([load_expression(p) for p in programs])[0]
+    _worker["size"] = (x_size, y_size)
+
+
+def _render_tile(rows):
+    """ Renders one band of rows straight into the shared image buffer. """
+    start, stop = rows
+    x_size, y_size = _worker["size"]
+    render_pixels(_worker["functions"], x_size, y_size, rows, out=_worker["pixels"][start:stop])
+    return stop - start
+
+
+def _render_band(rows):
+    """ Renders one band of rows and sends it back to the main process. """
+    x_size, y_size = _worker["size"]
+    return render_pixels(_worker["functions"], x_size, y_size, rows)
+
+
+def measure_pool_startup(processes):
+    """ Returns how many seconds it takes to start a pool of workers, hand each of them a trivial task,
+    and shut it down again.
+
+    - processes: the number of workers in the pool
+    """
+    base = time.perf_counter()
+
+    with mp.Pool(processes) as pool:
+        pool.map(abs, range(processes))
+
+    return time.perf_counter() - base
+
+
+# Where measured costs are kept between runs, shared by every machine that sees this directory
+CALIBRATION_FILE = os.path.join(os.path.expanduser("~"), ".cache", "recursive_art", "calibration.json")
+
+
+def calibrate(force=False, filename=CALIBRATION_FILE):
+    """ Measures how long this machine takes to evaluate one expression node for one pixel, and how
+    long a worker pool takes to start up and shut down. The results are cached in `filename` under
+    the host name and core count, so later runs only measure again when forced to.
+
+    - force: measure again even if there are cached results for this machine
+    - filename: the JSON file the results are cached in
+
+    # Unit tests wouldn't be very helpful with this function, as the results depend on the machine.
+    """
+    machine = "%s:%d" % (platform.node(), mp.cpu_count())
+    cache = {}
+
+    if os.path.exists(filename):
+        with open(filename) as f:
+            cache = json.load(f)
+
+    if machine in cache and not force:
+        return cache[machine]
+
+    # Time a fixed reference function, so the cost doesn't depend on the caller's random state
+    state = random.getstate()
+    random.seed(4558106513883317379)
+    functions = optimize_expressions([build_random_expression(9, 15) for _ in range(3)])[0]
+    random.setstate(state)
+
+    nodes = len(_schedule(functions)[0])
+    base = time.perf_counter()
+    render_pixels(functions, 256, 256)
+    node_cost = (time.perf_counter() - base) / (256 * 256 * nodes)
+
+    # Fit a fixed cost plus a cost per worker from a small and a larger pool
+    processes = min(mp.cpu_count(), 4)
+    single = measure_pool_startup(1)
+    worker_cost = (measure_pool_startup(processes) - single) / (processes - 1) if processes > 1 else single
+
+    cache[machine] = {
+        "node_cost": node_cost,
+        "pool_cost": max(0.0, single - worker_cost),
+        "worker_cost": max(0.0, worker_cost)
+    }
+
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(cache, f, indent=2)
+
+    return cache[machine]
+
+
+def plan_render(functions, x_size, y_size, calibration=None, cpus=None):
+    """ Picks the fastest way to render an image from the calibrated costs of this machine, by
+    estimating the time to evaluate every node of the functions for every pixel on one core against
+    the time to start a pool and split the same work across it. Returns ("sync", 1) or
+    ("async", workers).
+
+    - functions: the red, green, and blue expressions that will be rendered
+    - x_size, y_size: dimensions of the image
+    - calibration: costs as returned by `calibrate`, measured (or loaded) if not given
+    - cpus: the number of cores available, defaults to every core
+
+    # Pools pay off once the work is large enough to cover starting them, and stop adding workers
+      once each one costs more to start than it saves.
+    >>> costs = {"node_cost": 1e-8, "pool_cost": 0.05, "worker_cost": 0.01}
+    >>> random.seed(4558106513883317379)
+    >>> functions = [build_random_expression(9, 15) for _ in range(3)]
+    >>> plan_render(functions, 64, 64, costs, cpus=8)
+    ('sync', 1)
+    >>> plan_render(functions, 4000, 4000, costs, cpus=8)
+    ('async', 8)
+    >>> plan_render(functions, 4000, 4000, costs, cpus=1)
+    ('sync', 1)
+    """
+    calibration = calibration or calibrate()
+    cpus = cpus or mp.cpu_count()
+    nodes = len(_schedule(optimize_expressions(functions)[0])[0])
+    work = x_size * y_size * nodes * calibration["node_cost"]
+    best, plan = work, ("sync", 1)
+
+    for workers in range(2, cpus + 1):
+        cost = calibration["pool_cost"] + calibration["worker_cost"] * workers + work / workers
+
+        if cost < best:
+            best, plan = cost, ("async", workers)
+
+    return plan
+
+
+class RenderCache:
+    """ An on-disk cache of rendered images, keyed by the seed and depth bounds their functions were
+    built from and by their size. Once the images take up more than `max_bytes`, the least recently
+    used ones are removed. A request for a size that isn't cached can be served by shrinking a
+    larger cached image with the same aspect ratio, which is good enough for previews and thumbnails.
+
+    - directory: the directory to keep the images in, created if it doesn't exist
+    - max_bytes: the most disk space the cached images may use
+
+    >>> import tempfile
+    >>> cache = RenderCache(tempfile.mkdtemp(), max_bytes=10**6)
+    >>> cache.put(Image.new("RGB", (64, 32), (255, 0, 0)), 7, 9, 15)
+    >>> cache.get(7, 9, 15, 64, 32).size
+    (64, 32)
+    >>> cache.get(7, 9, 15, 16, 8).getpixel((0, 0))
+    (255, 0, 0)
+    >>> cache.get(7, 9, 15, 16, 16) is None, cache.get(7, 9, 15, 128, 64) is None
+    (True, True)
+    >>> cache.max_bytes = 0
+    >>> cache.put(Image.new("RGB", (8, 8)), 8, 9, 15)
+    >>> os.listdir(cache.directory)
+    []
+    """
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, seed, min_depth, max_depth, x_size, y_size):
+        """ Returns the file an image with the given key is kept in. """
+        return os.path.join(self.directory, "%s_%d_%d_%dx%d.png" % (seed, min_depth, max_depth, x_size, y_size))
+
+    def get(self, seed, min_depth, max_depth, x_size, y_size):
+        """ Returns the cached image for the key, shrinking the smallest larger image with the same
+        aspect ratio if there isn't one of exactly the right size, or None if neither exists. """
+        path = self._path(seed, min_depth, max_depth, x_size, y_size)
+
+        if not os.path.exists(path):
+            prefix = "%s_%d_%d_" % (seed, min_depth, max_depth)
+            sizes = []
+
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix):
+                    width, height = map(int, name[len(prefix):-len(".png")].split("x"))
+
+                    if width >= x_size and width * y_size == height * x_size:
+                        sizes.append((width, height))
+
+            if not sizes:
+                return None
+
+            path = self._path(seed, min_depth, max_depth, *min(sizes))
+
+        # Touching the file marks it as recently used, which eviction goes by
+        os.utime(path)
+
+        with Image.open(path) as image:
+            if image.size == (x_size, y_size):
+                return image.copy()
+
+            return image.resize((x_size, y_size), Image.LANCZOS)
+
+    def put(self, image, seed, min_depth, max_depth):
+        """ Stores a rendered image under the key it was built with, then evicts the least recently
+        used images until the cache fits within its size limit again. """
+        image.save(self._path(seed, min_depth, max_depth, *image.size))
+
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        paths.sort(key=os.path.getmtime)
+        total = sum(map(os.path.getsize, paths))
+
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+
+def generate_art(filename, x_size=350, y_size=350, functions=None, seed=None, cache=None):
     """ Generates computational art and saves as an image. Automatically determines if job should be
-    run on multiple or a single core based image size and available processors. Wraps `*_sync` and
-    `*_async`, but exists for compatability with base code.
+    run on multiple or a single core, and with how many workers, from the image size, the size of
+    the functions, and the costs measured by `calibrate` for this machine. Wraps `*_sync` and
+    `*_async`, but exists for compatability with base code. The red, green, and blue expressions
+    may be given as `functions`, otherwise random ones are built, from `seed` if one is given.
+    Art built from a seed is looked up in and added to `cache`, a `RenderCache`, if there is one.
 
     # Unit tests wouldn't be very helpful with this function, as it outputs a file.
     """
-    # If image is less than 4096 pixels or there is only 1 available core, run on a single core.
-    # Threshold determined experimentally.
-    if x_size * y_size < 64**2 or mp.cpu_count() < 2:
-        generate_art_sync(filename, x_size, y_size)
+    min_depth, max_depth = 9, 15
+    cached = functions is None and seed is not None and cache is not None
+
+    # Serve the image, or a shrunken copy of a larger one, straight from the cache if we can
+    if cached:
+        image = cache.get(seed, min_depth, max_depth, x_size, y_size)
+
+        if image is not None:
+            image.save(filename)
+            return
+
+    # The plan depends on how big the functions are, so they are built before choosing
+    if functions is None:
+        if seed is not None:
+            # Seeding shouldn't disturb the caller's random state, so it is put back afterwards
+            state = random.getstate()
+            random.seed(seed)
+
+        functions = [build_random_expression(min_depth, max_depth) for _ in range(3)]
+
+        if seed is not None:
+            random.setstate(state)
+
+    strategy, workers = plan_render(functions, x_size, y_size)
+
+    if strategy == "sync":
+        generate_art_sync(filename, x_size, y_size, functions)
     else:
-        generate_art_async(filename, x_size, y_size)
+        generate_art_async(filename, x_size, y_size, workers, functions)
 
+    if cached:
+        with Image.open(filename) as image:
+            cache.put(image, seed, min_depth, max_depth)
 
-def generate_art_sync(filename, x_size, y_size):
+
+def generate_art_sync(filename, x_size, y_size, functions=None):
     """ Generate computational art and save as an image file.
 
     - filename: string filename for image (should be .png)
     - x_size, y_size: dimensions of image
+    - functions: optional red, green, and blue expressions to render instead of random ones
 
     # Unit tests wouldn't be very helpful with this function, same as above.
     """
     # Functions for red, green, and blue channels - where the magic happens!
-    red_function = build_random_function(9, 20)
-    green_function = build_random_function(9, 20)
-    blue_function = build_random_function(9, 20)
-    
-    # Create image and loop over all pixels
-    im = Image.new("RGB", (x_size, y_size))
-    pixels = im.load()
-    
-    for i in range(x_size):
-        for j in range(y_size):
-            x = remap_interval(i, 0, x_size, -1, 1)
-            y = remap_interval(j, 0, y_size, -1, 1)
-            c = (x, y)
-            pixels[i, j] = (
-                color_map(red_function(c)),
-                color_map(green_function(c)),
-                color_map(blue_function(c))
-            )
+    if functions is None:
+        functions = [build_random_expression(9, 20) for _ in range(3)]
+
+    # Share common subexpressions between the channels, then evaluate whole bands of pixels
+    # at once rather than looping over them
+    functions = optimize_expressions(functions)[0]
+    pixels = np.empty((y_size, x_size, 3), dtype=np.uint8)
 
-    im.save(filename)
+    for start, stop in split_tiles(x_size, y_size, 1):
+        render_pixels(functions, x_size, y_size, (start, stop), out=pixels[start:stop])
 
+    Image.fromarray(pixels, "RGB").save(filename)
 
-def generate_art_async(filename, x_size, y_size):
-    """ Generate computational art with a worker pool and save as an image file.
+
+def generate_art_async(filename, x_size, y_size, processes=None, functions=None):
+    """ Generate computational art with a worker pool and save as an image file. The image is split
+    into bands of rows, and every worker writes its bands straight into one shared buffer. PNG and
+    PPM files are then written from that buffer a band at a time with `write_image_stream`, so the
+    image never exists twice. Other formats are handed to PIL, which copies the buffer since it
+    keeps RGB images at four bytes per pixel.
 
     - filename: string filename for image (should be .png)
     - x_size, y_size: dimensions of the image
-    
+    - processes: number of workers to use, defaults to every available core
+    - functions: optional red, green, and blue expressions to render instead of random ones
+
     # Unit tests wouldn't be very helpful with this function, same as above.
     """
     # Functions for red, green, and blue channels - where the magic happens!
-    red_function = build_random_function(9, 15)
-    green_function = build_random_function(9, 15)
-    blue_function = build_random_function(9, 15)
-    
-    # Create image of given size with RGB colorspace
-    im = Image.new("RGB", (x_size, y_size))
-    
-    # Define range of coordinates to pass to color functions.
-    # Cartesian product two ranges of values from -1 to 1 of [x/y]_size.
-    # This is equivilent to a nested for loop of range(size) with inner remap_interval call
-    # (see `generate_art_sync` for comparison).
-    coordinates = list(product(linspace(-1, 1, num=x_size), linspace(-1, 1, num=y_size)))
-
-    # Create a worker pool, using all cores because we're not nice
-    pool = mp.Pool(mp.cpu_count())
- 
-    # Split up all the color computations by sending them to the worker pool.
-    # Each job runs the specificed color function with one coordinate pair from the list.
-    reds = pool.map_async(red_function, coordinates)
-    greens = pool.map_async(green_function, coordinates)
-    blues = pool.map_async(blue_function, coordinates)
+    if functions is None:
+        functions = [build_random_expression(9, 15) for _ in range(3)]
+
+    # Workers only need the compiled programs, which are far cheaper to ship than trees
+    programs = [compile_expression(function) for function in functions]
+
+    # Using all cores because we're not nice
+    processes = processes or mp.cpu_count()
+    shm = mp.shared_memory.SharedMemory(create=True, size=max(1, x_size * y_size * 3))
+
+    try:
+        # Every worker attaches to the shared buffer once, then renders bands as they come in
+        with mp.Pool(processes, _init_worker, (programs, x_size, y_size, shm.name)) as pool:
+            for _ in pool.imap_unordered(_render_tile, split_tiles(x_size, y_size, processes)):
+                pass
+
+        # Views of the buffer must be gone before the memory is closed
+        pixels = np.ndarray((y_size, x_size, 3), dtype=np.uint8, buffer=shm.buf)
+
+        if filename.lower().endswith((".png", ".ppm")):
+            write_image_stream(filename, x_size, y_size, [pixels[a:b] for a, b in split_tiles(x_size, y_size, 1)])
+        else:
+            Image.fromarray(pixels, "RGB").save(filename)
+
+        del pixels
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def generate_art_stream(filename, x_size, y_size, processes=1, band_pixels=2**18, functions=None):
+    """ Generate computational art and stream it to disk in bands of rows as they are rendered, so
+    memory use depends on the band size rather than the image size. Meant for poster-sized images
+    that would not fit in memory, see `write_image_stream` for the supported formats.
+
+    - filename: string filename for image (should be .png or .ppm)
+    - x_size, y_size: dimensions of the image
+    - processes: number of workers rendering bands ahead of the writer, 1 renders in this process
+    - band_pixels: the largest number of pixels in one band
+    - functions: optional red, green, and blue expressions to render instead of random ones
+
+    # Unit tests wouldn't be very helpful with this function, same as above.
+    """
+    if functions is None:
+        functions = [build_random_expression(9, 15) for _ in range(3)]
 
-    # Zip together the individual values into a list of RGB tuples (r, g, b)
-    pixels = list(zip(
-        map(color_map, reds.get()),
-        map(color_map, greens.get()),
-        map(color_map, blues.get())
-     ))
+    tiles = split_tiles(x_size, y_size, processes, band_pixels)
 
-    # Close and resync the worker pool with the main process
-    pool.close()
-    pool.join()
+    if processes < 2:
+        functions = optimize_expressions(functions)[0]
+        bands = (render_pixels(functions, x_size, y_size, rows) for rows in tiles)
+        write_image_stream(filename, x_size, y_size, bands)
+        return
 
-    # Set the image data to the new pixels and save
-    im.putdata(pixels)
-    im.save(filename)
+    def render_ahead(pool):
+        # Only keep a couple of bands per worker in flight, so finished bands can't pile up
+        # in memory faster than they are written
+        for i in range(0, len(tiles), 2 * processes):
+            yield from pool.imap(_render_band, tiles[i:i + 2 * processes])
+
+    programs = [compile_expression(function) for function in functions]
+
+    with mp.Pool(processes, _init_worker, (programs, x_size, y_size)) as pool:
+        write_image_stream(filename, x_size, y_size, render_ahead(pool))
+
+
+def generate_movie(filename, x_size, y_size, frames=30, batch=8, duration=100, functions=None):
+    """ Generate an animation of one random function evolving over time, and save it as a GIF or as a
+    numbered image sequence. Frames are rendered in batches, so the expressions are walked once per
+    batch rather than once per frame. Returns the average wall-clock time per frame in seconds.
+
+    - filename: string filename for the animation, either a .gif or a pattern with a `{}` for the
+      frame number, such as "frame{:03d}.png"
+    - x_size, y_size: dimensions of each frame
+    - frames: the number of frames, with time running from -1 to 1 across them
+    - batch: the number of frames rendered at once
+    - duration: how long each frame of a GIF is shown in milliseconds
+    - functions: optional animated red, green, and blue expressions to render instead of random ones
+
+    # Unit tests wouldn't be very helpful with this function, same as above.
+    """
+    if functions is None:
+        functions = [build_random_expression(9, 15, animated=True) for _ in range(3)]
+
+    base = time.perf_counter()
+    functions = optimize_expressions(functions)[0]
+    times = remap_interval(np.arange(frames), 0, frames, -1, 1)
+    images = []
+
+    for start in range(0, frames, batch):
+        pixels = render_frames(functions, x_size, y_size, times[start:start + batch])
+
+        for k, frame in enumerate(pixels, start):
+            image = Image.fromarray(frame, "RGB")
+
+            # GIFs are written all at once at the end, sequences one frame at a time
+            if filename.lower().endswith(".gif"):
+                images.append(image)
+            else:
+                image.save(filename.format(k))
+
+    if images:
+        images[0].save(filename, save_all=True, append_images=images[1:], duration=duration, loop=0)
+
+    return (time.perf_counter() - base) / frames
 
 
 
@@ -259,17 +1100,22 @@ if __name__ == '__main__':
     # 205.28423964200192      (multi)
     # 660.2333436690024       (single)
     #
-    #import timeit
-    #print(timeit.timeit("generate_art_async('art_test.png', 350, 350)", number=10, setup="from __main__ import generate_art_async; import random; random.seed(4558106513883317379)"))
-    #print(timeit.timeit("generate_art_sync('art_test2.png', 350, 350)", number=10, setup="from __main__ import generate_art_sync; import random; random.seed(4558106513883317379)"))
+    # The renderers are now timed across sizes, depths, seeds, and worker counts by `benchmark.py`,
+    # and `generate_art` picks between them from the costs measured by `calibrate`.
+    #
+    # >>> python benchmark.py --sizes 350x350 --output benchmark.json
     
     # Prompt the user for filenames and image dimensions, and print the runtiem for fun
-    import time
     filename = input('[Recursive Art] How would you like to write your image (filename.png)? ')
     width = int(input('[Recursive Art] What width of image would you like to generate? '))
     height = int(input('[Recursive Art] What should its height be? '))
     base = time.time()
     print("\n==============\n")
 
-    generate_art(filename, width, height)
+    # Build the functions up front so we can see how much sharing subexpressions saves
+    functions = [build_random_expression(9, 15) for _ in range(3)]
+    removed = optimize_expressions(functions)[1]
+    print("Nodes removed by optimization:", removed)
+
+    generate_art(filename, width, height, functions)
     print("Time to generate:", time.time() - base, "seconds\n")